@@ -0,0 +1,75 @@
+"""Measures the cost of parsing and validating a webhook body.
+
+Compares the previous approach (``request.json`` followed by repeated dictionary lookups in the
+decorator, ``_process_request`` and the route handler) with the typed payloads of rasa_vier_cvg.payloads.
+Both decode the body with ``payloads.loads``, so only the lookups and the validation are compared, not the JSON decoders.
+
+Usage: python benchmarks/bench_payloads.py [iterations]
+"""
+import json
+import sys
+import timeit
+
+from rasa_vier_cvg import payloads
+from rasa_vier_cvg.payloads import MessageRequest
+
+BODY = json.dumps({
+    "dialogId": "09e59647-5c77-4c02-a1c5-7fb2b47060f1",
+    "projectContext": {
+        "projectToken": "d30b1c38-b2fd-39c8-bec2-b268871338b0",
+        "resellerToken": "ed4aff6d-c6f8-4ac9-ab67-d072ef45d9a0",
+    },
+    "timestamp": 1535546718115,
+    "type": "SPEECH",
+    "text": "Hello!",
+    "confidence": 100,
+    "vendor": "GOOGLE",
+    "language": "en-US",
+    "callback": "https://cognitivevoice.io/v1",
+    "authToken": "a9b8c7d6-e5f4-4a3b-8c2d-1e0f9a8b7c6d",
+}).encode("utf-8")
+
+
+def previous():
+    # valid_request
+    json_body = payloads.loads(BODY)
+    if json_body is None:
+        return None
+    if json_body["dialogId"] is None:
+        return None
+    if json_body["callback"] is None:
+        return None
+    if "projectContext" not in json_body:
+        return None
+    project_context = json_body["projectContext"]
+    if "resellerToken" not in project_context:
+        return None
+    if "projectToken" not in project_context:
+        return None
+    # message and _process_request
+    text = json_body["text"]
+    dialog_id = json_body["dialogId"]
+    reseller_token = json_body["projectContext"]["resellerToken"]
+    project_token = json_body["projectContext"]["projectToken"]
+    # _process_message
+    callback = json_body["callback"]
+    auth_token = json_body["authToken"]
+    return text, dialog_id, reseller_token, project_token, callback, auth_token
+
+
+def typed():
+    payload = MessageRequest.parse(BODY)
+    return payload.text, payload.dialog_id, payload.reseller_token, payload.project_token, payload.callback, payload.auth_token
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    assert previous() == typed()
+    print(f"{iterations} iterations, both decode with {payloads.JSON_DECODER}")
+    for name, func in (("previous", previous), ("typed", typed)):
+        best = min(timeit.repeat(func, number=iterations, repeat=5))
+        print(f"{name:>8}: {best / iterations * 1e6:.2f} us per request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Load test of the CVG channel against a local CVG stub.
+
+Starts a stub of CVG's callback API and a Sanic app serving the channel's webhook with a fake bot, then drives
+many concurrent dialogs through /session, /message and /terminated. Every combination of blocking_endpoints,
+blocking_output and ignore_messages_when_busy is measured in turn.
+
+The turn latency is the time from sending a /message to CVG receiving the bot's answer to it via /call/say. Like a
+caller who waits for the bot to finish talking, a dialog only sends /terminated once the answer to its last message
+arrived (or --hangup-timeout passed), since /terminated cancels the speech that has not been sent yet.
+
+Run it from the root of the repository, as it reuses the CVG stub of the tests:
+
+    python -m benchmarks.load --dialogs 200 --messages 5 --bot-time 0.05 --cvg-latency 0.02
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+import uuid
+from typing import Any, Dict, List, Text
+
+from aiohttp import ClientSession, web
+from sanic import Sanic
+
+from rasa.core.channels.channel import UserMessage
+
+from rasa_vier_cvg.cvg import BUSY_MODES, CVGInput
+from tests.cvg_stub import CVGStub, free_port
+
+TOKEN = "load-test-token"
+WEBHOOK_PREFIX = "/webhooks/vier-cvg"
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LoadCVGStub(CVGStub):
+    """Answers CVG's callback API after a configurable latency and fails a configurable fraction of the requests"""
+
+    def __init__(self, latency: float, jitter: float, failure_rate: float) -> None:
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.said: Dict[Text, float] = {}
+        self.failures = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body: Any = await request.json() if request.can_read_body else {}
+        # Only the number of requests is of interest, keeping their bodies would distort long runs
+        self.requests.append((request.method, request.path, None))
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if random.random() < self.failure_rate:
+            self.failures += 1
+            return web.json_response({"error": "injected failure"}, status=503)
+
+        if request.path == "/call/say":
+            self.said.setdefault(body.get("text", ""), time.perf_counter())
+        elif request.path in ("/call/forward", "/call/bridge"):
+            return web.json_response({"status": "Success", "dialogId": body.get("dialogId")})
+        return web.Response(status=204)
+
+
+def fake_bot(bot_time: float):
+    async def on_new_message(message: UserMessage):
+        await asyncio.sleep(bot_time)
+        # The answer carries the text of the message, so the stub can match it to the turn
+        await message.output_channel.send_text_message(message.sender_id, f"answer:{message.text}", None)
+
+    return on_new_message
+
+
+class Run:
+    def __init__(self, blocking_endpoints: bool, blocking_output: bool, ignore_messages_when_busy: Text) -> None:
+        self.blocking_endpoints = blocking_endpoints
+        self.blocking_output = blocking_output
+        self.ignore_messages_when_busy = ignore_messages_when_busy
+        self.sent: Dict[Text, float] = {}
+        self.webhook_latencies: List[float] = []
+        self.webhook_errors = 0
+
+    def name(self) -> Text:
+        return f"endpoints={str(self.blocking_endpoints):<5} output={str(self.blocking_output):<5} busy={self.ignore_messages_when_busy:<6}"
+
+
+async def post(session: ClientSession, run: Run, url: Text, body: Dict) -> None:
+    start = time.perf_counter()
+    async with session.post(url, data=json.dumps(body), headers={"Authorization": f"Bearer {TOKEN}", "Content-Type": "application/json"}) as res:
+        await res.read()
+        if res.status >= 300:
+            run.webhook_errors += 1
+    run.webhook_latencies.append(time.perf_counter() - start)
+
+
+async def dialog(session: ClientSession, run: Run, stub: LoadCVGStub, base_url: Text, messages: int, think_time: float, hangup_timeout: float):
+    dialog_id = str(uuid.uuid4())
+    body = {
+        "dialogId": dialog_id,
+        "projectContext": {"projectToken": "load-test-project", "resellerToken": "load-test-reseller"},
+        "callback": stub.url,
+        "authToken": "load-test-auth-token",
+        "timestamp": 0,
+    }
+    await post(session, run, f"{base_url}/session", body)
+    for index in range(messages):
+        text = f"{dialog_id}-{index}"
+        run.sent[f"answer:{text}"] = time.perf_counter()
+        await post(session, run, f"{base_url}/message", dict(body, text=text, type="SPEECH"))
+        await asyncio.sleep(think_time)
+    deadline = time.perf_counter() + hangup_timeout
+    while f"answer:{dialog_id}-{messages - 1}" not in stub.said and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    await post(session, run, f"{base_url}/terminated", body)
+
+
+async def execute(run: Run, args: argparse.Namespace, index: int) -> Dict[Text, float]:
+    stub = LoadCVGStub(args.cvg_latency, args.cvg_jitter, args.cvg_failure_rate)
+    await stub.__aenter__()
+
+    channel = CVGInput(TOKEN, "/cvg_session", None, run.blocking_endpoints, run.blocking_output, run.ignore_messages_when_busy)
+    app = Sanic(f"cvg_load_test_{index}")
+    # TouchUp rewrites the server classes once per process and fails for every app started after the first one
+    app.config.TOUCHUP = False
+    app.blueprint(channel.blueprint(fake_bot(args.bot_time)), url_prefix=WEBHOOK_PREFIX)
+    port = free_port()
+    server = await app.create_server(host="127.0.0.1", port=port, access_log=False, return_asyncio_server=True)
+    await server.startup()
+    await server.start_serving()
+
+    base_url = f"http://127.0.0.1:{port}{WEBHOOK_PREFIX}"
+    start = time.perf_counter()
+    async with ClientSession() as session:
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited():
+            async with semaphore:
+                await dialog(session, run, stub, base_url, args.messages, args.think_time, args.hangup_timeout)
+
+        await asyncio.gather(*(limited() for _ in range(args.dialogs)))
+
+    # Without blocking endpoints the answers arrive after the webhook requests returned.
+    # Messages ignored by ignore_messages_when_busy are never answered, so stop waiting once no more answers arrive.
+    deadline = time.perf_counter() + args.settle_timeout
+    answered = -1
+    idle_since = time.perf_counter()
+    while time.perf_counter() < deadline and time.perf_counter() - idle_since < args.settle_idle:
+        if len(stub.said) != answered:
+            answered = len(stub.said)
+            idle_since = time.perf_counter()
+        if all(text in stub.said for text in run.sent):
+            break
+        await asyncio.sleep(0.01)
+    elapsed = max([start] + list(stub.said.values())) - start
+
+    await server.before_stop()
+    await server.close()
+    await server.after_stop()
+    await stub.__aexit__()
+
+    latencies = [stub.said[text] - sent for text, sent in run.sent.items() if text in stub.said]
+    return {
+        "turns": len(run.sent),
+        "answered": len(latencies),
+        "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "webhook_p50": percentile(run.webhook_latencies, 0.50),
+        "webhook_p99": percentile(run.webhook_latencies, 0.99),
+        "webhook_errors": run.webhook_errors,
+        "cvg_requests": len(stub.requests),
+        "cvg_failures": stub.failures,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dialogs", type=int, default=200, help="number of dialogs per run")
+    parser.add_argument("--concurrency", type=int, default=100, help="number of dialogs running at the same time")
+    parser.add_argument("--messages", type=int, default=5, help="messages per dialog")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds between the messages of a dialog")
+    parser.add_argument("--hangup-timeout", type=float, default=5.0, help="seconds a dialog waits for the answer to its last message before sending /terminated")
+    parser.add_argument("--bot-time", type=float, default=0.05, help="seconds the fake bot needs per message")
+    parser.add_argument("--cvg-latency", type=float, default=0.02, help="seconds the CVG stub needs per request")
+    parser.add_argument("--cvg-jitter", type=float, default=0.005, help="random deviation of the CVG stub latency in seconds")
+    parser.add_argument("--cvg-failure-rate", type=float, default=0.0, help="fraction of CVG stub requests that fail with 503")
+    parser.add_argument("--settle-timeout", type=float, default=30.0, help="seconds to wait for outstanding answers after the last request")
+    parser.add_argument("--settle-idle", type=float, default=2.0, help="stop waiting for outstanding answers after this many seconds without a new one")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("rasa_vier_cvg").setLevel(logging.CRITICAL)
+
+    print(f"{args.dialogs} dialogs x {args.messages} messages, bot {args.bot_time * 1000:.0f} ms, CVG {args.cvg_latency * 1000:.0f} ms, failure rate {args.cvg_failure_rate}")
+    print(f"{'configuration':<44} {'answered':>10} {'turns/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'hook p50':>9} {'hook p99':>9} {'errors':>7}")
+    for index, (blocking_endpoints, blocking_output, ignore_messages_when_busy) in enumerate(itertools.product((True, False), (True, False), BUSY_MODES)):
+        run = Run(blocking_endpoints, blocking_output, ignore_messages_when_busy)
+        result = await execute(run, args, index)
+        print(
+            f"{run.name():<44} {result['answered']:>5}/{result['turns']:<4} {result['throughput']:>8.1f}"
+            f" {result['p50'] * 1000:>8.1f} {result['p95'] * 1000:>8.1f} {result['p99'] * 1000:>8.1f}"
+            f" {result['webhook_p50'] * 1000:>9.1f} {result['webhook_p99'] * 1000:>9.1f} {result['webhook_errors']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Text, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class BusyDialogStore(ABC):
+    """Tracks the dialogs that currently have a turn in progress.
+
+    A dialog is marked busy by acquiring a lease, which expires after ttl seconds,
+    so a turn that crashed or got lost cannot lock its dialog forever.
+    """
+
+    ttl: float
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+
+    @abstractmethod
+    async def acquire(self, dialog_id: Text) -> Optional[Text]:
+        """Returns a lease token or None if the dialog is already busy."""
+
+    @abstractmethod
+    async def release(self, dialog_id: Text, token: Text) -> None:
+        """Releases the lease, unless it expired and has been acquired again in the meantime."""
+
+    @abstractmethod
+    async def renew(self, dialog_id: Text, token: Text) -> bool:
+        """Extends the lease by another ttl seconds, returns False if the lease is no longer held."""
+
+    @abstractmethod
+    async def count(self) -> int:
+        """Returns the number of busy dialogs."""
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemoryBusyDialogStore(BusyDialogStore):
+    """Keeps the leases in this process, so it only works with a single Rasa instance and Sanic worker"""
+
+    # This dict is not thread safe. However, sanic is not multithreaded.
+    leases: Dict[Text, Tuple[Text, float]]
+
+    def __init__(self, ttl: float, clock: Callable[[], float] = time.monotonic) -> None:
+        super().__init__(ttl)
+        self.leases = {}
+        self.clock = clock
+
+    async def acquire(self, dialog_id: Text) -> Optional[Text]:
+        now = self.clock()
+        lease = self.leases.get(dialog_id)
+        if lease is not None and lease[1] > now:
+            return None
+        token = uuid.uuid4().hex
+        self.leases[dialog_id] = (token, now + self.ttl)
+        return token
+
+    async def release(self, dialog_id: Text, token: Text) -> None:
+        lease = self.leases.get(dialog_id)
+        if lease is not None and lease[0] == token:
+            del self.leases[dialog_id]
+
+    async def renew(self, dialog_id: Text, token: Text) -> bool:
+        lease = self.leases.get(dialog_id)
+        if lease is None or lease[0] != token:
+            return False
+        self.leases[dialog_id] = (token, self.clock() + self.ttl)
+        return True
+
+    async def count(self) -> int:
+        now = self.clock()
+        expired = [dialog_id for dialog_id, (_, expires_at) in self.leases.items() if expires_at <= now]
+        for dialog_id in expired:
+            del self.leases[dialog_id]
+        return len(self.leases)
+
+
+class SqliteBusyDialogStore(BusyDialogStore):
+    """Keeps the leases in a SQLite file, which can be shared by all Sanic workers and Rasa instances on a host"""
+
+    path: Text
+
+    def __init__(self, ttl: float, path: Text) -> None:
+        super().__init__(ttl)
+        self.path = path
+        # All statements run on a single thread, so the connection is never used concurrently and the event loop never blocks on the file lock
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cvg-busy-dialogs")
+        self.connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS busy_dialogs (dialog_id TEXT PRIMARY KEY, token TEXT NOT NULL, expires_at REAL NOT NULL)")
+            self.connection = connection
+        return self.connection
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _acquire(self, dialog_id: Text) -> Optional[Text]:
+        connection = self._connect()
+        now = time.time()
+        token = uuid.uuid4().hex
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM busy_dialogs WHERE dialog_id = ? AND expires_at <= ?", (dialog_id, now))
+            cursor = connection.execute("INSERT OR IGNORE INTO busy_dialogs (dialog_id, token, expires_at) VALUES (?, ?, ?)", (dialog_id, token, now + self.ttl))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return token if cursor.rowcount == 1 else None
+
+    def _release(self, dialog_id: Text, token: Text):
+        self._connect().execute("DELETE FROM busy_dialogs WHERE dialog_id = ? AND token = ?", (dialog_id, token))
+
+    def _renew(self, dialog_id: Text, token: Text) -> bool:
+        cursor = self._connect().execute("UPDATE busy_dialogs SET expires_at = ? WHERE dialog_id = ? AND token = ?", (time.time() + self.ttl, dialog_id, token))
+        return cursor.rowcount == 1
+
+    def _count(self) -> int:
+        row = self._connect().execute("SELECT COUNT(*) FROM busy_dialogs WHERE expires_at > ?", (time.time(),)).fetchone()
+        return row[0]
+
+    def _close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    async def acquire(self, dialog_id: Text) -> Optional[Text]:
+        return await self._run(self._acquire, dialog_id)
+
+    async def release(self, dialog_id: Text, token: Text) -> None:
+        await self._run(self._release, dialog_id, token)
+
+    async def renew(self, dialog_id: Text, token: Text) -> bool:
+        return await self._run(self._renew, dialog_id, token)
+
+    async def count(self) -> int:
+        return await self._run(self._count)
+
+    async def close(self) -> None:
+        await self._run(self._close)
+        self.executor.shutdown(wait=False)
+
+
+class RedisBusyDialogStore(BusyDialogStore):
+    """Keeps the leases in Redis (or any server speaking its protocol), which can be shared by any number of Rasa instances"""
+
+    KEY_PREFIX = "rasa_vier_cvg:busy:"
+    # A sorted set of the busy dialogs scored by the expiry of their lease, so they can be counted without scanning the keyspace
+    LEASES_KEY = "rasa_vier_cvg:busy_leases"
+    # The key and its entry in the sorted set are changed by a single script each, so a failure cannot leave one without the other
+    ACQUIRE_SCRIPT = "if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then redis.call('zadd', KEYS[2], ARGV[3], ARGV[4]) return 1 else return 0 end"
+    # Only delete the key if it still holds our lease
+    RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then redis.call('zrem', KEYS[2], ARGV[2]) return redis.call('del', KEYS[1]) else return 0 end"
+    # Only extend the key if it still holds our lease
+    RENEW_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then redis.call('zadd', KEYS[2], ARGV[3], ARGV[4]) return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+
+    url: Text
+
+    def __init__(self, ttl: float, url: Text, client: Any = None) -> None:
+        super().__init__(ttl)
+        self.url = url
+        if client is None:
+            try:
+                import redis.asyncio
+            except ImportError:
+                raise ValueError('The redis busy dialog store requires the redis package, install it with: pip install rasa-vier-cvg[redis]')
+            client = redis.asyncio.from_url(url)
+        self.client = client
+
+    async def acquire(self, dialog_id: Text) -> Optional[Text]:
+        token = uuid.uuid4().hex
+        acquired = await self.client.eval(self.ACQUIRE_SCRIPT, 2, self.KEY_PREFIX + dialog_id, self.LEASES_KEY, token, int(self.ttl * 1000), time.time() + self.ttl, dialog_id)
+        return token if acquired else None
+
+    async def release(self, dialog_id: Text, token: Text) -> None:
+        # If the dialog has been acquired again, its entry in the sorted set belongs to the new lease and is kept
+        await self.client.eval(self.RELEASE_SCRIPT, 2, self.KEY_PREFIX + dialog_id, self.LEASES_KEY, token, dialog_id)
+
+    async def renew(self, dialog_id: Text, token: Text) -> bool:
+        renewed = await self.client.eval(self.RENEW_SCRIPT, 2, self.KEY_PREFIX + dialog_id, self.LEASES_KEY, token, int(self.ttl * 1000), time.time() + self.ttl, dialog_id)
+        return bool(renewed)
+
+    async def count(self) -> int:
+        await self.client.zremrangebyscore(self.LEASES_KEY, "-inf", time.time())
+        return await self.client.zcard(self.LEASES_KEY)
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+def create_busy_dialog_store(kind: Text, ttl: float, path: Optional[Text], url: Optional[Text]) -> BusyDialogStore:
+    if kind == "memory":
+        return InMemoryBusyDialogStore(ttl)
+    if kind == "sqlite":
+        if not path:
+            raise ValueError('The sqlite busy dialog store requires busy_dialog_store_path in your credentials.yml!')
+        return SqliteBusyDialogStore(ttl, path)
+    if kind == "redis":
+        if not url:
+            raise ValueError('The redis busy dialog store requires busy_dialog_store_url in your credentials.yml!')
+        return RedisBusyDialogStore(ttl, url)
+    raise ValueError(f'Unknown busy_dialog_store {kind}, use one of: memory, sqlite, redis')
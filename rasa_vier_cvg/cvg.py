@@ -1,10 +1,14 @@
 import asyncio
-import copy
 import json
 import base64
 import logging
-from functools import wraps
-from typing import Any, Awaitable, Callable, Dict, Optional, Text, TypeVar, Coroutine, Set
+import random
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from functools import lru_cache, wraps
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Text, Type, TypeVar, Coroutine, Set, Tuple
+from urllib.parse import urlsplit
 import warnings
 import aiohttp
 
@@ -18,25 +22,100 @@ from sanic.response import HTTPResponse
 import rasa.shared.utils.io
 from rasa.core.channels.channel import InputChannel, OutputChannel, UserMessage
 
+from rasa_vier_cvg import metrics
+from rasa_vier_cvg.busy import BusyDialogStore, InMemoryBusyDialogStore, create_busy_dialog_store
+from rasa_vier_cvg.logs import LazyPayload, configure_logging, parse_sample_rates
+from rasa_vier_cvg.metadata import OUTBOUND_ROUTE, REFER_ROUTE, MetadataProjections
+from rasa_vier_cvg.outbox import Outbox, OutboxCommand, create_outbox
+# The field constants used to be defined in this module and are re-exported for backwards compatibility
+from rasa_vier_cvg.payloads import (  # noqa: F401
+    AUTH_TOKEN_FIELD,
+    CALLBACK_FIELD,
+    DIALOG_ID_FIELD,
+    PROJECT_CONTEXT_FIELD,
+    PROJECT_TOKEN_FIELD,
+    RESELLER_TOKEN_FIELD,
+    TIMESTAMP_FIELD,
+    AnswerRequest,
+    InactivityRequest,
+    InvalidPayload,
+    MessageRequest,
+    RecordingRequest,
+    SessionRequest,
+    TerminatedRequest,
+    WebhookRequest,
+)
+
 logger = logging.getLogger(__name__)
 
 CHANNEL_NAME = "vier-cvg"
 OPERATION_PREFIX = "cvg_"
-DIALOG_ID_FIELD = "dialogId"
-PROJECT_CONTEXT_FIELD = "projectContext"
-RESELLER_TOKEN_FIELD = "resellerToken"
-PROJECT_TOKEN_FIELD = "projectToken"
-CALLBACK_FIELD = "callback"
-AUTH_TOKEN_FIELD = "authToken"
+SAY_PATH = "/call/say"
+
+# Gateway errors signal that the request did not reach CVG, so it is safe to send it again
+RETRYABLE_STATUS_CODES = frozenset([502, 503, 504])
+# CVG only answers forward and bridge once the outbound call has been established or has failed,
+# so these requests take as long as the callee needs to pick up
+OUTBOUND_CALL_PATHS = frozenset(["/call/forward", "/call/bridge"])
+# The status of a command that did not get any response, CVG may have executed it nevertheless
+NO_RESPONSE = -1
+# The status of a command that never reached CVG, because no connection could be established or the circuit breaker is open
+NOT_SENT = -2
+# The outbox additionally retries commands that were not sent, until they expire.
+# Commands without a response are not sent again, CVG may have executed them already.
+OUTBOX_RETRYABLE_STATUS_CODES = RETRYABLE_STATUS_CODES | {NOT_SENT}
+# Only a new input of the caller or the end of the dialog cancel the speech of earlier turns that has not been sent yet
+SUPERSEDING_ROUTES = frozenset([MessageRequest.ROUTE, AnswerRequest.ROUTE, TerminatedRequest.ROUTE])
 
 T = TypeVar('T')
 
+# The turn of the dialog whose message is currently being processed, commands are tagged with it
+CURRENT_TURN: ContextVar[Optional[int]] = ContextVar("cvg_current_turn", default=None)
+
+
+def get_credential(credentials: Dict[Text, Any], key: Text, default: T, convert: Callable[[Any], T]) -> T:
+    value = credentials.get(key)
+    if value is None:
+        return default
+    return convert(value)
+
+
+# What happens to a message that arrives while the dialog is still busy with an earlier one:
+# it is processed concurrently (off), ignored (drop) or processed after the current turn if no newer message arrives (latest)
+BUSY_MODES = ("off", "drop", "latest")
+
+
+def parse_busy_mode(value: Any) -> Text:
+    """Accepts one of the BUSY_MODES as well as a boolean, which was the only option before the latest mode existed"""
+    if value is None or value is False:
+        return "off"
+    if value is True:
+        return "drop"
+    mode = str(value).lower()
+    if mode not in BUSY_MODES:
+        raise ValueError(f'Unknown ignore_messages_when_busy {value}, use one of: {", ".join(BUSY_MODES)}')
+    return mode
+
 
 def make_metadata(payload: T) -> Dict[str, T]:
     return {"cvg_body": payload}
 
 
+# Compact recipient ids look like "cvg1:<reseller token>:<project token>:<dialog id>".
+# The colon is not part of the base64 alphabet, so they can never be confused with the original encoding.
+COMPACT_RECIPIENT_ID_PREFIX = "cvg1:"
+COMPACT_RECIPIENT_ID_SEPARATOR = ":"
+RECIPIENT_ID_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=RECIPIENT_ID_CACHE_SIZE)
 def parse_recipient_id(recipient_id: Text) -> (str, str, str):
+    if recipient_id.startswith(COMPACT_RECIPIENT_ID_PREFIX):
+        parts = recipient_id[len(COMPACT_RECIPIENT_ID_PREFIX):].split(COMPACT_RECIPIENT_ID_SEPARATOR)
+        if len(parts) != 3:
+            raise ValueError('The given recipient id is incompatible with this output!')
+        return parts[0], parts[1], parts[2]
+
     parsed_json = json.loads(base64.b64decode(bytes(recipient_id, 'utf-8')).decode('utf-8'))
     if type(parsed_json) is not list or len(parsed_json) != 3:
         raise ValueError('The given recipient id is incompatible with this output!')
@@ -44,7 +123,18 @@ def parse_recipient_id(recipient_id: Text) -> (str, str, str):
     return parsed_json[2], parsed_json[1], parsed_json[0]
 
 
-def create_recipient_id(reseller_token, project_token, dialog_id) -> Text:
+# The dialog paths contain tokens, so they are mapped back to the operation name to keep the number of metric labels bounded
+def operation_label(method: str, path: str) -> str:
+    if path.startswith("/dialog/"):
+        return "dialog_delete" if method == "DELETE" else "dialog_data"
+    return path[1:].replace('/', '_')
+
+
+def create_recipient_id(reseller_token, project_token, dialog_id, compact: bool = False) -> Text:
+    # Tokens containing the separator cannot be split again, so they fall back to the original encoding
+    if compact and not any(COMPACT_RECIPIENT_ID_SEPARATOR in token for token in (reseller_token, project_token, dialog_id)):
+        return f"{COMPACT_RECIPIENT_ID_PREFIX}{reseller_token}{COMPACT_RECIPIENT_ID_SEPARATOR}{project_token}{COMPACT_RECIPIENT_ID_SEPARATOR}{dialog_id}"
+
     json_representation = json.dumps([
         dialog_id,
         project_token,
@@ -53,13 +143,402 @@ def create_recipient_id(reseller_token, project_token, dialog_id) -> Text:
     return base64.b64encode(bytes(json_representation, 'utf-8')).decode('utf-8')
 
 
+class TaskContainerFull(Exception):
+    """Raised when a TaskContainer can neither start nor queue another task"""
+
+
 class TaskContainer:
-    tasks: Set[asyncio.Task] = set()
+    """Runs fire-and-forget coroutines, with an optional cap on concurrent tasks and a bounded waiting queue"""
+
+    tasks: Set[asyncio.Task]
+    waiting: Deque[Coroutine[Any, Any, None]]
+    max_tasks: int
+    max_queued: int
+
+    def __init__(self, max_tasks: int = 0, max_queued: int = 1000) -> None:
+        self.tasks = set()
+        self.waiting = deque()
+        self.max_tasks = max_tasks
+        self.max_queued = max_queued
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.waiting)
+
+    # Unbounded tasks are always started immediately. They are meant for cheap work that must not be lost,
+    # but they still count towards the limit of the bounded tasks and are drained on shutdown.
+    # Returns the task if it has been started right away, or None if it is waiting for a free slot.
+    def run(self, coro: Coroutine[Any, Any, None], bounded: bool = True) -> Optional[asyncio.Task]:
+        if not bounded or self.max_tasks <= 0 or len(self.tasks) < self.max_tasks:
+            return self._start(coro)
+        elif len(self.waiting) < self.max_queued:
+            self.waiting.append(coro)
+        else:
+            coro.close()
+            raise TaskContainerFull(f"{len(self.tasks)} tasks are running and {len(self.waiting)} are waiting")
+        return None
 
-    def run(self, coro: Coroutine[Any, Any, None]):
+    def _start(self, coro: Coroutine[Any, Any, None]) -> asyncio.Task:
         task = asyncio.create_task(coro)
         self.tasks.add(task)
-        task.add_done_callback(self.tasks.discard)
+        task.add_done_callback(self._on_done)
+        return task
+
+    def _on_done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        while self.waiting and (self.max_tasks <= 0 or len(self.tasks) < self.max_tasks):
+            self._start(self.waiting.popleft())
+
+    async def drain(self, timeout: float):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.tasks:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            await asyncio.wait(set(self.tasks), timeout=remaining)
+
+        if self.tasks or self.waiting:
+            logger.warning(f"Shutdown deadline exceeded, cancelling {len(self.tasks)} running and {len(self.waiting)} waiting tasks")
+        while self.waiting:
+            self.waiting.popleft().close()
+        for task in list(self.tasks):
+            task.cancel()
+
+
+class DialogCommandQueue:
+    """Sends the outbound commands of a dialog strictly in order, while different dialogs are sent concurrently"""
+
+    # Every command is queued with the turn it belongs to, None if it must never be superseded, whether it is speech
+    # and whether it is detached
+    queues: Dict[Text, Deque[Tuple[Coroutine[Any, Any, T], asyncio.Future, Optional[int], bool, bool]]]
+    workers: Dict[Text, asyncio.Task]
+    # Whether the command each worker is currently sending is speech
+    sending_speech: Dict[Text, bool]
+    # The detached commands still waiting for their response
+    detached: Set[asyncio.Task]
+    # The latest turn of any dialog. Turns are numbered by the queue rather than by the output channel, so an output
+    # created again for a dialog, e.g. after its session has been evicted, still supersedes the commands queued before.
+    last_turn: int
+
+    def __init__(self) -> None:
+        self.queues = {}
+        self.workers = {}
+        self.sending_speech = {}
+        self.detached = set()
+        self.last_turn = 0
+
+    def next_turn(self) -> int:
+        self.last_turn += 1
+        return self.last_turn
+
+    # The command is enqueued immediately, so the order of submit() calls is the order in which the commands are sent.
+    # The queue of a dialog is removed as soon as it is drained, so idle or terminated dialogs do not hold any resources.
+    # A command allowed alongside speech is sent right away if only speech is ahead of it, later commands still wait for it.
+    # A detached command waits for the commands ahead of it, but the commands after it do not wait for its response.
+    def submit(self, dialog_id: Text, coro: Coroutine[Any, Any, T], turn: Optional[int] = None, speech: bool = False, alongside_speech: bool = False, detached: bool = False) -> "asyncio.Future[T]":
+        if alongside_speech and self._only_speech_pending(dialog_id):
+            task = asyncio.ensure_future(coro)
+            self._enqueue(dialog_id, asyncio.wait({task}), asyncio.get_running_loop().create_future(), None, False, False)
+            return task
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(dialog_id, coro, future, turn, speech, detached)
+        return future
+
+    def _only_speech_pending(self, dialog_id: Text) -> bool:
+        if not self.sending_speech.get(dialog_id, True):
+            return False
+        return all(speech for _, _, _, speech, _ in self.queues.get(dialog_id, ()))
+
+    def _enqueue(self, dialog_id: Text, coro: Coroutine[Any, Any, Any], future: asyncio.Future, turn: Optional[int], speech: bool, detached: bool):
+        queue = self.queues.get(dialog_id)
+        if queue is None:
+            queue = deque()
+            self.queues[dialog_id] = queue
+        queue.append((coro, future, turn, speech, detached))
+        if dialog_id not in self.workers:
+            self.workers[dialog_id] = asyncio.create_task(self._drain(dialog_id, queue))
+
+    # Commands that are already being sent are not affected, CVG has most likely received them already.
+    def supersede(self, dialog_id: Text, turn: int) -> int:
+        """Cancels the queued commands of the dialog that belong to a turn before the given one, returns their number"""
+        queue = self.queues.get(dialog_id)
+        if not queue:
+            return 0
+        kept = []
+        cancelled = 0
+        for entry in queue:
+            coro, future, entry_turn, _, _ = entry
+            if entry_turn is not None and entry_turn < turn:
+                coro.close()
+                future.cancel()
+                cancelled += 1
+            else:
+                kept.append(entry)
+        if cancelled:
+            # The worker holds a reference to the queue, so it is changed in place
+            queue.clear()
+            queue.extend(kept)
+        return cancelled
+
+    async def _drain(self, dialog_id: Text, queue: Deque[Tuple[Coroutine[Any, Any, T], asyncio.Future, Optional[int], bool, bool]]):
+        try:
+            while queue:
+                coro, future, _, speech, detached = queue.popleft()
+                if future.done():
+                    coro.close()
+                    continue
+                if detached:
+                    self._start_detached(coro, future)
+                    continue
+                self.sending_speech[dialog_id] = speech
+                try:
+                    result = await coro
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            while queue:
+                coro, future, _, _, _ = queue.popleft()
+                coro.close()
+                future.cancel()
+            if self.queues.get(dialog_id) is queue:
+                del self.queues[dialog_id]
+            del self.workers[dialog_id]
+            self.sending_speech.pop(dialog_id, None)
+
+    def _start_detached(self, coro: Coroutine[Any, Any, T], future: asyncio.Future):
+        task = asyncio.ensure_future(coro)
+        self.detached.add(task)
+
+        def resolve(task: asyncio.Task):
+            self.detached.discard(task)
+            if future.done():
+                return
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+
+        task.add_done_callback(resolve)
+
+
+class RetryPolicy:
+    """Exponential backoff with jitter, bounded by a timeout budget for the whole operation"""
+
+    max_retries: int
+    backoff_base: float
+    backoff_max: float
+    jitter: float
+    timeout: float
+    # The budget of forward and bridge, 0 means no limit
+    outbound_call_timeout: float
+
+    def __init__(self, max_retries: int = 3, backoff_base: float = 0.1, backoff_max: float = 2.0, jitter: float = 0.5, timeout: float = 10.0, outbound_call_timeout: float = 600.0) -> None:
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.timeout = timeout
+        self.outbound_call_timeout = outbound_call_timeout
+
+    def backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * (1.0 - self.jitter * random.random())
+
+    def __repr__(self) -> str:
+        return f"RetryPolicy(max_retries={self.max_retries}, backoff_base={self.backoff_base}, backoff_max={self.backoff_max}, jitter={self.jitter}, timeout={self.timeout}, outbound_call_timeout={self.outbound_call_timeout})"
+
+
+class CircuitBreaker:
+    """Fails fast while a callback host is unhealthy.
+
+    The breaker opens after failure_threshold consecutive failures. After reset_timeout seconds a single probe request
+    is let through (half open): its success closes the breaker again, its failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    host: Text
+    failure_threshold: int
+    reset_timeout: float
+    state: Text
+    failures: int
+
+    def __init__(self, host: Text, failure_threshold: int = 5, reset_timeout: float = 30.0, clock: Callable[[], float] = time.monotonic) -> None:
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at: Optional[float] = None
+
+    def allow(self) -> bool:
+        if self.failure_threshold <= 0:
+            return True
+        now = self.clock()
+        if self.state == CircuitBreaker.OPEN:
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            self._transition(CircuitBreaker.HALF_OPEN)
+        if self.state == CircuitBreaker.HALF_OPEN:
+            # A probe that never reported back must not keep the breaker half open forever
+            if self.probe_started_at is not None and now - self.probe_started_at < self.reset_timeout:
+                return False
+            self.probe_started_at = now
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.probe_started_at = None
+        if self.state != CircuitBreaker.CLOSED:
+            self._transition(CircuitBreaker.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_started_at = None
+        if self.failure_threshold <= 0:
+            return
+        if self.state == CircuitBreaker.HALF_OPEN or (self.state == CircuitBreaker.CLOSED and self.failures >= self.failure_threshold):
+            self.opened_at = self.clock()
+            self._transition(CircuitBreaker.OPEN)
+
+    def _transition(self, state: Text):
+        logger.warning(f"Circuit breaker for {self.host} changed from {self.state} to {state} (consecutive failures: {self.failures})")
+        self.state = state
+
+
+class CircuitBreakerRegistry:
+    """Holds one CircuitBreaker per callback host"""
+
+    breakers: Dict[Text, CircuitBreaker]
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.breakers = {}
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    def get(self, base_url: Text) -> CircuitBreaker:
+        host = urlsplit(base_url).netloc
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(host, self.failure_threshold, self.reset_timeout)
+            self.breakers[host] = breaker
+        return breaker
+
+    def states(self) -> Dict[Text, Text]:
+        return {host: breaker.state for host, breaker in self.breakers.items()}
+
+
+class ClientSessionPool:
+    """Process-wide pool of long-lived HTTP sessions, keyed by callback base URL and proxy"""
+
+    sessions: Dict[Tuple[str, Optional[str]], aiohttp.ClientSession]
+    limit: int
+    limit_per_host: int
+    dns_cache_ttl: Optional[int]
+    keepalive_timeout: float
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 0, dns_cache_ttl: Optional[int] = 10, keepalive_timeout: float = 15.0) -> None:
+        self.sessions = {}
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+
+    def get(self, base_url: str, proxy: Optional[str]) -> aiohttp.ClientSession:
+        key = (base_url, proxy)
+        session = self.sessions.get(key)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                use_dns_cache=self.dns_cache_ttl is not None,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            self.sessions[key] = session
+        return session
+
+    async def close(self):
+        sessions = list(self.sessions.values())
+        self.sessions.clear()
+        for session in sessions:
+            if not session.closed:
+                await session.close()
+
+
+class Operation:
+    """How a cvg_* operation of a custom JSON message is sent to CVG"""
+
+    __slots__ = ("name", "method", "path_template", "inject_dialog_id", "fire_and_forget", "result_handler", "alongside_speech", "durable")
+
+    name: Text
+    method: Text
+    # Formatted with the reseller_token and dialog_id of the dialog
+    path_template: Text
+    inject_dialog_id: bool
+    # Call operations are always sent in the background, regardless of blocking_output
+    fire_and_forget: bool
+    # The name of the CVGOutput method processing the response, called with the status, body, dialog id and recipient id
+    result_handler: Optional[Text]
+    # These operations keep their order relative to all other commands of the dialog, except that they do not wait for speech
+    alongside_speech: bool
+    # Durable operations are sent via the outbox, if one is configured
+    durable: bool
+
+    def __init__(self, name: Text, method: Text, path_template: Text, inject_dialog_id: bool, fire_and_forget: bool, result_handler: Optional[Text] = None, alongside_speech: bool = False, durable: bool = False) -> None:
+        self.name = name
+        self.method = method
+        self.path_template = path_template
+        self.inject_dialog_id = inject_dialog_id
+        self.fire_and_forget = fire_and_forget
+        self.result_handler = result_handler
+        self.alongside_speech = alongside_speech
+        self.durable = durable
+
+    def path(self, reseller_token: Text, dialog_id: Text) -> Text:
+        if "{" not in self.path_template:
+            return self.path_template
+        return self.path_template.format(reseller_token=reseller_token, dialog_id=dialog_id)
+
+    @classmethod
+    def call(cls, name: Text, result_handler: Optional[Text] = None, durable: bool = False) -> "Operation":
+        return cls(name, "POST", "/" + name.replace("_", "/"), True, True, result_handler, durable=durable)
+
+
+OPERATIONS: Dict[Text, Operation] = {
+    operation.name: operation for operation in [
+        # The response from forward and bridge must be handled
+        Operation.call("call_forward", "_handle_bridge_result", durable=True),
+        Operation.call("call_bridge", "_handle_bridge_result"),
+        Operation.call("call_refer", "_handle_refer_result"),
+        Operation("dialog_delete", "DELETE", "/dialog/{reseller_token}/{dialog_id}", False, False, durable=True),
+        Operation("dialog_data", "POST", "/dialog/{reseller_token}/{dialog_id}/data", False, False, alongside_speech=True, durable=True),
+    ]
+}
+
+
+def get_operation(name: Text) -> Optional[Operation]:
+    operation = OPERATIONS.get(name)
+    # Every call operation maps to the Call API endpoint of the same name, so they are compiled on first use
+    if operation is None and name.startswith("call_"):
+        operation = Operation.call(name)
+        OPERATIONS[name] = operation
+    return operation
 
 
 class CVGOutput(OutputChannel):
@@ -70,21 +549,45 @@ class CVGOutput(OutputChannel):
     headers: Dict[str, str]
     proxy: Optional[str]
     task_container: TaskContainer
+    session_pool: ClientSessionPool
+    command_queue: DialogCommandQueue
+    retry_policy: RetryPolicy
+    circuit_breakers: CircuitBreakerRegistry
+    say_separator: Optional[str]
+    say_buffer: Dict[str, List[str]]
+    outbox: Optional[Outbox]
+    # The latest turn of the dialog, the speech of earlier turns is superseded
+    turn: int
+    metadata_projections: MetadataProjections
 
     @classmethod
     def name(cls) -> Text:
         return CHANNEL_NAME
 
-    def __init__(self, callback_base_url: Text, auth_token: Text, on_message: Callable[[UserMessage], Awaitable[Any]], proxy: Optional[str], task_container: TaskContainer, blocking_output: bool) -> None:
+    def __init__(self, callback_base_url: Text, auth_token: Text, on_message: Callable[[UserMessage], Awaitable[Any]], proxy: Optional[str], task_container: TaskContainer, blocking_output: bool, session_pool: ClientSessionPool, command_queue: DialogCommandQueue, retry_policy: RetryPolicy, circuit_breakers: CircuitBreakerRegistry, say_separator: Optional[str] = None, outbox: Optional[Outbox] = None, metadata_projections: Optional[MetadataProjections] = None) -> None:
         self.on_message = on_message
 
+        self.callback = callback_base_url
         self.base_url = callback_base_url.rstrip('/')
+        self.auth_token = auth_token
         self.headers = {
             "Authorization": f"Bearer {auth_token}",
         }
         self.proxy = proxy
         self.task_container = task_container
         self.blocking_output = blocking_output
+        self.session_pool = session_pool
+        self.command_queue = command_queue
+        self.retry_policy = retry_policy
+        self.circuit_breakers = circuit_breakers
+        # Without a separator every text is said immediately, otherwise the texts are buffered until flush() is called
+        self.say_separator = say_separator
+        self.say_buffer = {}
+        self.outbox = outbox
+        self.turn = command_queue.last_turn
+        if metadata_projections is None:
+            metadata_projections = MetadataProjections()
+        self.metadata_projections = metadata_projections
 
     # This functionality can be used to ignore certain messages received by this channel.
     # It can be used as a workaround for dialog setups that produce messages that should not be forwarded to CVG but still be tracked.
@@ -96,63 +599,197 @@ class CVGOutput(OutputChannel):
     def _is_ignored(self, custom_json) -> bool:
         return custom_json is not None and "ignore" in custom_json and custom_json["ignore"] is True
 
-    async def _perform_request_sync(self, path: str, method: str, data: Optional[any], dialog_id: Optional[str], retries: int = 0) -> (Optional[int], any):
+    async def _send_request(self, method: str, url: str, data: Optional[any], timeout: Optional[float]) -> (int, any):
+        session = self.session_pool.get(self.base_url, self.proxy)
+        async with session.request(method, url, json=data, proxy=self.proxy, headers=self.headers, timeout=aiohttp.ClientTimeout(total=timeout)) as res:
+            status = res.status
+            if status == 204:
+                return status, {}
+
+            body = await res.json()
+            return status, body
+
+    async def _perform_request_sync(self, path: str, method: str, data: Optional[any], dialog_id: Optional[str]) -> (Optional[int], any):
+        operation = operation_label(method, path)
+        start = time.perf_counter()
+        status, body = await self._perform_request_with_retries(path, method, data, dialog_id, operation)
+        duration = time.perf_counter() - start
+        metrics.OUTBOUND_REQUESTS.inc(operation, str(status))
+        metrics.OUTBOUND_DURATION.observe(duration, operation)
+        logger.info("%s - Sent %s: status=%s", dialog_id, operation, status, extra={"dialog_id": dialog_id, "operation": operation, "status": status, "duration": duration})
+        return status, body
+
+    async def _perform_request_with_retries(self, path: str, method: str, data: Optional[any], dialog_id: Optional[str], operation: str) -> (Optional[int], any):
         url = f"{self.base_url}{path}"
-        status = -1
+        breaker = self.circuit_breakers.get(self.base_url)
+        loop = asyncio.get_running_loop()
+        outbound_call = path in OUTBOUND_CALL_PATHS
+        timeout = self.retry_policy.outbound_call_timeout if outbound_call else self.retry_policy.timeout
+        deadline = loop.time() + timeout if timeout > 0 else None
+        status = NOT_SENT
         body = None
-        try:
-            async with aiohttp.request(method, url, json=data, proxy=self.proxy, headers=self.headers) as res:
-                status = res.status
-                if status == 204:
-                    return status, {}
+        attempt = 0
+        # Set once an attempt may have reached CVG, from then on the command must not be reported as not sent
+        maybe_received = False
+        while True:
+            if not breaker.allow():
+                logger.error("%s - The circuit breaker for %s is %s, not sending %s %s", dialog_id, breaker.host, breaker.state, method, url, extra={"dialog_id": dialog_id, "operation": operation})
+                return (NO_RESPONSE if maybe_received else NOT_SENT), None
 
-                body = await res.json()
-                return status, body
-        except aiohttp.ClientResponseError as e:
-            return e.status, e.message
-        except aiohttp.ClientConnectionError:
-            if retries < 3:
-                logger.error(f"{dialog_id} - The connection failed, retrying...")
-                return await self._perform_request_sync(path, method, data, dialog_id, retries + 1)
-            else:
-                logger.error(f"{dialog_id} - {retries} retries all failed, that's it!")
+            try:
+                status, body = await self._send_request(method, url, data, None if deadline is None else deadline - loop.time())
+                if status not in RETRYABLE_STATUS_CODES:
+                    breaker.record_success()
+                    return status, body
+                failure = f"status={status}"
+            except aiohttp.ClientResponseError as e:
+                status, body = e.status, e.message
+                if status not in RETRYABLE_STATUS_CODES:
+                    breaker.record_success()
+                    return status, body
+                failure = f"status={status}"
+            except asyncio.TimeoutError:
+                if outbound_call:
+                    # CVG may still establish the call, so the request must not be sent again and says nothing about the health of the host
+                    logger.error("%s - %s %s did not return a result within %ss", dialog_id, method, url, timeout, extra={"dialog_id": dialog_id, "operation": operation})
+                    return NO_RESPONSE, None
+                status, body = NO_RESPONSE, None
+                maybe_received = True
+                failure = "timeout"
+            except aiohttp.ClientConnectorError as e:
+                status, body = NOT_SENT, None
+                failure = f"connection failed: {e}"
+            except aiohttp.ClientConnectionError as e:
+                # The connection broke after the request may have been sent
+                status, body = NO_RESPONSE, None
+                maybe_received = True
+                failure = f"connection failed: {e}"
+            breaker.record_failure()
+
+            delay = self.retry_policy.backoff(attempt)
+            attempt += 1
+            if attempt > self.retry_policy.max_retries or (deadline is not None and loop.time() + delay >= deadline):
+                logger.error("%s - %s attempts of %s %s all failed (%s), that's it!", dialog_id, attempt, method, url, failure, extra={"dialog_id": dialog_id, "operation": operation, "status": status})
+                if maybe_received:
+                    return NO_RESPONSE, None
                 return status, body
+            logger.error("%s - The request failed (%s), retrying in %.3fs...", dialog_id, failure, delay, extra={"dialog_id": dialog_id, "operation": operation, "status": status})
+            metrics.OUTBOUND_RETRIES.inc(operation)
+            await asyncio.sleep(delay)
+
+    def _perform_request_queued(self, path: str, method: str, data: Optional[any], dialog_id: Optional[str], turn: Optional[int] = None, alongside_speech: bool = False) -> "asyncio.Future[Tuple[Optional[int], any]]":
+        # Forward and bridge are only answered once the callee picked up, so the following commands must not wait for them
+        return self.command_queue.submit(dialog_id, self._perform_request_sync(path, method, data, dialog_id), turn, path == SAY_PATH, alongside_speech, path in OUTBOUND_CALL_PATHS)
+
+    def _perform_request_async(self, path: str, method: str, data: Optional[any], dialog_id: Optional[str], process_result: Optional[Callable[..., Coroutine[Any, Any, None]]], *process_result_args: Any, alongside_speech: bool = False, turn: Optional[int] = None):
+        # The result is processed outside of the queue, because it may trigger a new turn which sends commands to the same dialog.
+        result = self._perform_request_queued(path, method, data, dialog_id, turn, alongside_speech)
 
-    def _perform_request_async(self, path: str, method: str, data: Optional[any], dialog_id: Optional[str], process_result: Callable[[int, any], Coroutine[Any, Any, None]]):
         async def perform():
-            status, body = await self._perform_request_sync(path, method, data, dialog_id)
-            await process_result(status, body)
+            status, body = await result
+            if process_result is not None:
+                await process_result(status, body, *process_result_args)
 
-        self.task_container.run(perform())
+        self.task_container.run(perform(), bounded=False)
 
-    async def _perform_request(self, path: str, method: str, data: Optional[any], dialog_id: Optional[str]):
-        async def handle_result(status_code, response_body):
-            if not 200 <= status_code < 300:
-                url = f"{self.base_url}{path}"
-                logger.error(f"{dialog_id} - Failed to send command to CVG via {method} {url}: status={status_code}, message={response_body}")
-                return
+    async def _log_failed_command(self, status_code: int, response_body: any, method: str, path: str, dialog_id: Optional[str]):
+        if not 200 <= status_code < 300:
+            url = f"{self.base_url}{path}"
+            logger.error("%s - Failed to send command to CVG via %s %s: status=%s, message=%s", dialog_id, method, url, status_code, LazyPayload(response_body), extra={"dialog_id": dialog_id, "status": status_code})
 
+    # Only requests sent in the background can be tagged with a turn, because superseding them must not abort a waiting turn.
+    async def _perform_request(self, path: str, method: str, data: Optional[any], dialog_id: Optional[str], alongside_speech: bool = False, turn: Optional[int] = None):
         if self.blocking_output:
-            result = await self._perform_request_sync(path, method, data, dialog_id)
-            await handle_result(*result)
+            result = await self._perform_request_queued(path, method, data, dialog_id, alongside_speech=alongside_speech)
+            await self._log_failed_command(*result, method, path, dialog_id)
         else:
-            self._perform_request_async(path, method, data, dialog_id, handle_result)
+            self._perform_request_async(path, method, data, dialog_id, self._log_failed_command, method, path, dialog_id, alongside_speech=alongside_speech, turn=turn)
+
+    # The command is stored in the outbox in the background and takes its place in the dialog's command queue right away,
+    # so it keeps its order relative to the other commands. Its result is processed once the outbox delivered it.
+    # Without a running process the result is lost, so failures of commands delivered after a restart are only logged.
+    def _perform_request_durable(self, path: str, method: str, data: Optional[any], dialog_id: str, process_result: Optional[Callable[..., Coroutine[Any, Any, None]]], *process_result_args: Any, alongside_speech: bool = False):
+        command = OutboxCommand.create(dialog_id, self.callback, self.auth_token, method, path, data, self.outbox.ttl)
+        written = self.outbox.add(command)
+        delivery = self.command_queue.submit(dialog_id, self.outbox.send(command, written, self._send_command), alongside_speech=alongside_speech, detached=path in OUTBOUND_CALL_PATHS)
+
+        async def perform():
+            status, body = await delivery
+            if process_result is not None:
+                await process_result(status, body, *process_result_args)
+
+        self.task_container.run(perform(), bounded=False)
+
+    def _send_command(self, command: OutboxCommand) -> Coroutine[Any, Any, Tuple[int, Any]]:
+        return self._perform_request_sync(command.path, command.method, command.data, command.dialog_id)
+
+    def start_turn(self, dialog_id: str) -> int:
+        """Starts a new turn of the dialog, which cancels the speech of earlier turns that has not been sent yet"""
+        self.turn = self.command_queue.next_turn()
+        if not self.blocking_output:
+            cancelled = self.command_queue.supersede(dialog_id, self.turn)
+            if self.say_buffer.pop(dialog_id, None) is not None:
+                cancelled += 1
+            if cancelled > 0:
+                logger.info("%s - Cancelled %s say commands of earlier turns", dialog_id, cancelled, extra={"dialog_id": dialog_id, "operation": "call_say"})
+                metrics.OUTBOUND_SUPERSEDED.inc(amount=cancelled)
+        return self.turn
+
+    def _speech_turn(self) -> Optional[int]:
+        # With blocking_output the turn waits for its commands, so they are never superseded
+        return None if self.blocking_output else CURRENT_TURN.get()
+
+    def _is_superseded(self, dialog_id: str, turn: Optional[int]) -> bool:
+        if turn is None or turn >= self.turn:
+            return False
+        logger.info("%s - Not saying text of turn %s, turn %s already started", dialog_id, turn, self.turn, extra={"dialog_id": dialog_id, "operation": "call_say"})
+        metrics.OUTBOUND_SUPERSEDED.inc()
+        return True
 
     async def _say(self, dialog_id: str, text: str):
         if len(text.strip()) > 0:
-            await self._perform_request("/call/say", method="POST", data={DIALOG_ID_FIELD: dialog_id, "text": text}, dialog_id=dialog_id)
+            turn = self._speech_turn()
+            if self._is_superseded(dialog_id, turn):
+                return
+            if self.say_separator is not None:
+                self.say_buffer.setdefault(dialog_id, []).append(text)
+                return
+            await self._perform_request(SAY_PATH, method="POST", data={DIALOG_ID_FIELD: dialog_id, "text": text}, dialog_id=dialog_id, turn=turn)
+
+    async def flush(self):
+        """Says all buffered texts, merging the consecutive texts of a dialog into a single say command"""
+        if not self.say_buffer:
+            return
+        say_buffer = self.say_buffer
+        self.say_buffer = {}
+        turn = self._speech_turn()
+        for dialog_id, texts in say_buffer.items():
+            if self._is_superseded(dialog_id, turn):
+                continue
+            text = self.say_separator.join(texts)
+            await self._perform_request(SAY_PATH, method="POST", data={DIALOG_ID_FIELD: dialog_id, "text": text}, dialog_id=dialog_id, turn=turn)
+
+    # The result of a command arrives in a task created by the turn that sent it, possibly minutes later,
+    # so the message it triggers starts a turn of its own instead of being superseded together with that turn.
+    async def _on_message_and_flush(self, user_message: UserMessage, dialog_id: Text):
+        turn = CURRENT_TURN.set(self.start_turn(dialog_id))
+        try:
+            await self.on_message(user_message)
+        finally:
+            await self.flush()
+            CURRENT_TURN.reset(turn)
 
     async def send_text_message(self, recipient_id: Text, text: Text, custom, **kwargs: Any) -> None:
         if self._is_ignored(custom):
             return
 
         reseller_token, project_token, dialog_id = parse_recipient_id(recipient_id)
-        logger.info(f"{dialog_id} - Sending text to say: {text}")
+        logger.info("%s - Sending text to say: %s", dialog_id, text, extra={"dialog_id": dialog_id, "operation": "call_say"})
         await self._say(dialog_id, text)
 
     async def _handle_refer_result(self, status_code: int, result: Dict, dialog_id: Text, recipient_id: Text):
         if 200 <= status_code < 300:
-            logger.info(f"{dialog_id} - Refer request succeeded: {status_code} with body {result}")
+            logger.info("%s - Refer request succeeded: %s with body %s", dialog_id, status_code, LazyPayload(result), extra={"dialog_id": dialog_id, "operation": "call_refer", "status": status_code})
             return
 
         user_message = UserMessage(
@@ -160,25 +797,26 @@ class CVGOutput(OutputChannel):
             output_channel=self,
             sender_id=recipient_id,
             input_channel=CHANNEL_NAME,
-            metadata=make_metadata(result),
+            metadata=make_metadata(self.metadata_projections.apply(REFER_ROUTE, result)),
         )
 
-        logger.info(f"{dialog_id} - Creating incoming UserMessage: text={user_message.text}, output_channel={user_message.output_channel}, sender_id={user_message.sender_id}, metadata={user_message.metadata}")
-        await self.on_message(user_message)
+        logger.info("%s - Creating incoming UserMessage: text=%s, sender_id=%s, metadata=%s", dialog_id, user_message.text, user_message.sender_id, LazyPayload(user_message.metadata), extra={"dialog_id": dialog_id})
+        await self._on_message_and_flush(user_message, dialog_id)
 
     async def _handle_bridge_result(self, status_code: int, result: Dict, dialog_id: Text, recipient_id: Text):
         if not 200 <= status_code < 300:
-            logger.info(f"{dialog_id} - Bridge request failed: {status_code} with body {result}")
+            logger.info("%s - Bridge request failed: %s with body %s", dialog_id, status_code, LazyPayload(result), extra={"dialog_id": dialog_id, "status": status_code})
             return
 
         status = result["status"]
+        metadata = make_metadata(self.metadata_projections.apply(OUTBOUND_ROUTE, result))
         if status == "Success":
             user_message = UserMessage(
                 text="/cvg_outbound_success",
                 output_channel=self,
                 sender_id=recipient_id,
                 input_channel=CHANNEL_NAME,
-                metadata=make_metadata(result),
+                metadata=metadata,
             )
         elif status == "Failure":
             user_message = UserMessage(
@@ -186,67 +824,58 @@ class CVGOutput(OutputChannel):
                 output_channel=self,
                 sender_id=recipient_id,
                 input_channel=CHANNEL_NAME,
-                metadata=make_metadata(result),
+                metadata=metadata,
             )
         else:
-            logger.info(f"{dialog_id} - Invalid bridge result: {status}")
+            logger.info("%s - Invalid bridge result: %s", dialog_id, status, extra={"dialog_id": dialog_id})
             return
 
-        logger.info(f"{dialog_id} - Creating incoming UserMessage: text={user_message.text}, output_channel={user_message.output_channel}, sender_id={user_message.sender_id}, metadata={user_message.metadata}")
-        await self.on_message(user_message)
+        logger.info("%s - Creating incoming UserMessage: text=%s, sender_id=%s, metadata=%s", dialog_id, user_message.text, user_message.sender_id, LazyPayload(user_message.metadata), extra={"dialog_id": dialog_id})
+        await self._on_message_and_flush(user_message, dialog_id)
 
     async def _execute_operation_by_name(self, operation_name: Text, body: Any, recipient_id: Text):
         reseller_token, project_token, dialog_id = parse_recipient_id(recipient_id)
-        logger.info(f"{dialog_id} - Execute action {operation_name} with body: {body}")
+        logger.info("%s - Execute action %s with body: %s", dialog_id, operation_name, LazyPayload(body), extra={"dialog_id": dialog_id, "operation": operation_name})
 
+        operation = get_operation(operation_name)
+        if operation is None:
+            logger.error("%s - Operation %s not found/not implemented yet.", dialog_id, operation_name, extra={"dialog_id": dialog_id, "operation": operation_name})
+            return
+        await self._execute_operation(operation, body, reseller_token, dialog_id, recipient_id)
+        logger.info("%s - Operation %s complete", dialog_id, operation_name, extra={"dialog_id": dialog_id, "operation": operation_name})
+
+    async def _execute_operation(self, operation: Operation, body: Any, reseller_token: Text, dialog_id: Text, recipient_id: Text):
+        # The body is only copied if the dialog id has to be added, nested values are never modified
         if body is None:
-            new_body = {}
+            data = {DIALOG_ID_FIELD: dialog_id} if operation.inject_dialog_id else {}
+        elif operation.inject_dialog_id and DIALOG_ID_FIELD not in body:
+            data = dict(body)
+            data[DIALOG_ID_FIELD] = dialog_id
         else:
-            new_body = copy.deepcopy(body)
-
-        if operation_name.startswith("call_"):
-            if DIALOG_ID_FIELD not in new_body:
-                new_body[DIALOG_ID_FIELD] = dialog_id
-
-            path = '/' + operation_name.replace('_', '/')
-
-            # The response from forward and bridge must be handled
-            handle_result_outbound_call_result_for = ["call_forward", "call_bridge"]
-            if operation_name in handle_result_outbound_call_result_for:
-                async def handle_outbound(status_code, response_body):
-                    await self._handle_bridge_result(status_code, response_body, dialog_id, recipient_id)
-                callback = handle_outbound
-            elif operation_name == 'call_refer':
-                async def handle_refer(status_code, response_body):
-                    await self._handle_refer_result(status_code, response_body, dialog_id, recipient_id)
-                callback = handle_refer
-            else:
-                async def do_nothing(*args):
-                    pass
-                callback = do_nothing
-
-            self._perform_request_async(path, method="POST", data=new_body, dialog_id=dialog_id, process_result=callback)
+            data = body
 
-        elif operation_name.startswith("dialog_"):
-            if operation_name == "dialog_delete":
-                await self._perform_request(f"/dialog/{reseller_token}/{dialog_id}", method="DELETE", data=new_body, dialog_id=dialog_id)
-            elif operation_name == "dialog_data":
-                await self._perform_request(f"/dialog/{reseller_token}/{dialog_id}/data", method="POST", data=new_body, dialog_id=dialog_id)
+        path = operation.path(reseller_token, dialog_id)
+        if operation.durable and self.outbox is not None:
+            if operation.fire_and_forget:
+                result_handler = None if operation.result_handler is None else getattr(self, operation.result_handler)
+                self._perform_request_durable(path, operation.method, data, dialog_id, result_handler, dialog_id, recipient_id, alongside_speech=operation.alongside_speech)
             else:
-                logger.error(f"{dialog_id} - Dialog operation {operation_name} not found/not implemented yet.")
-                return
+                self._perform_request_durable(path, operation.method, data, dialog_id, self._log_failed_command, operation.method, path, dialog_id, alongside_speech=operation.alongside_speech)
+        elif operation.fire_and_forget:
+            result_handler = None if operation.result_handler is None else getattr(self, operation.result_handler)
+            self._perform_request_async(path, operation.method, data, dialog_id, result_handler, dialog_id, recipient_id, alongside_speech=operation.alongside_speech)
         else:
-            logger.error(f"{dialog_id} - Operation {operation_name} not found/not implemented yet.")
-            return
-        logger.info(f"{dialog_id} - Operation {operation_name} complete")
+            await self._perform_request(path, operation.method, data, dialog_id, alongside_speech=operation.alongside_speech)
 
     async def send_custom_json(self, recipient_id: Text, json_message: Dict[Text, Any], **kwargs: Any) -> None:
         if self._is_ignored(json_message):
             return
 
+        # Buffered texts must be said before any command, to keep the order of the bot's responses
+        await self.flush()
+
         for operation_name, body in json_message.items():
             if operation_name[:len(OPERATION_PREFIX)] == OPERATION_PREFIX:
-                await asyncio.sleep(0.050)
                 await self._execute_operation_by_name(operation_name[len(OPERATION_PREFIX):], body, recipient_id)
 
     async def send_image_url(*args: Any, **kwargs: Any) -> None:
@@ -258,6 +887,113 @@ class CVGOutput(OutputChannel):
         )
 
 
+class DialogSession:
+    """The state of an active dialog, shared by all of its requests"""
+
+    __slots__ = ("dialog_id", "sender_id", "callback", "auth_token", "output", "last_seen", "recent_requests")
+
+    dialog_id: Text
+    sender_id: Text
+    callback: Text
+    auth_token: Text
+    output: CVGOutput
+    last_seen: float
+    # Fingerprints of the recently received requests, ordered from the oldest to the newest
+    recent_requests: "OrderedDict[Tuple, float]"
+
+    def __init__(self, dialog_id: Text, sender_id: Text, callback: Text, auth_token: Text, output: CVGOutput) -> None:
+        self.dialog_id = dialog_id
+        self.sender_id = sender_id
+        self.callback = callback
+        self.auth_token = auth_token
+        self.output = output
+        self.last_seen = 0.0
+        self.recent_requests = OrderedDict()
+
+    def is_duplicate(self, fingerprint: Tuple, window: float, limit: int, now: float) -> bool:
+        """Remembers the fingerprint and tells whether it has already been seen in the last window seconds"""
+        recent_requests = self.recent_requests
+        while recent_requests:
+            seen = next(iter(recent_requests.values()))
+            if now - seen < window:
+                break
+            recent_requests.popitem(last=False)
+        if fingerprint in recent_requests:
+            return True
+        recent_requests[fingerprint] = now
+        while len(recent_requests) > limit:
+            recent_requests.popitem(last=False)
+        return False
+
+    def forget(self, fingerprint: Tuple):
+        """Forgets a fingerprint, so the request is processed when it is delivered again"""
+        self.recent_requests.pop(fingerprint, None)
+
+
+class DialogSessionRegistry:
+    """Holds the sessions of the active dialogs, bounded by max_sessions and evicting sessions idle for longer than ttl seconds"""
+
+    # Ordered from the least to the most recently used session
+    sessions: "OrderedDict[Text, DialogSession]"
+    # The request fingerprints of removed sessions and until when they are kept, ordered from the oldest to the newest
+    removed: "OrderedDict[Text, Tuple[float, OrderedDict[Tuple, float]]]"
+    max_sessions: int
+    ttl: float
+
+    def __init__(self, max_sessions: int = 10000, ttl: float = 3600.0, clock: Callable[[], float] = time.monotonic) -> None:
+        self.sessions = OrderedDict()
+        self.removed = OrderedDict()
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.clock = clock
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def get(self, dialog_id: Text) -> Optional[DialogSession]:
+        now = self.clock()
+        self._evict_expired(now)
+        session = self.sessions.get(dialog_id)
+        if session is not None:
+            session.last_seen = now
+            self.sessions.move_to_end(dialog_id)
+        return session
+
+    def add(self, session: DialogSession):
+        session.last_seen = self.clock()
+        # A request delivered again after its dialog has been removed must still be recognized as a duplicate
+        removed = self.removed.pop(session.dialog_id, None)
+        if removed is not None and removed[0] > session.last_seen:
+            session.recent_requests = removed[1]
+        self.sessions[session.dialog_id] = session
+        self.sessions.move_to_end(session.dialog_id)
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+
+    def remove(self, dialog_id: Text, keep_requests_for: float = 0.0) -> Optional[DialogSession]:
+        """Removes the session, its request fingerprints are kept for another keep_requests_for seconds"""
+        session = self.sessions.pop(dialog_id, None)
+        if session is not None and session.recent_requests and keep_requests_for > 0:
+            self.removed[dialog_id] = (self.clock() + keep_requests_for, session.recent_requests)
+            self.removed.move_to_end(dialog_id)
+            while len(self.removed) > self.max_sessions:
+                self.removed.popitem(last=False)
+        return session
+
+    def _evict_expired(self, now: float):
+        # The least recently used sessions come first, so only the expired ones at the front need to be looked at
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if now - session.last_seen < self.ttl:
+                break
+            self.sessions.popitem(last=False)
+        while self.removed:
+            keep_until, _ = next(iter(self.removed.values()))
+            if now < keep_until:
+                break
+            self.removed.popitem(last=False)
+
+
 class CVGInput(InputChannel):
     """Input channel for the Cognitive Voice Gateway"""
 
@@ -266,11 +1002,29 @@ class CVGInput(InputChannel):
     proxy: Optional[str]
     expected_authorization_header_value: str
     blocking_endpoints: bool
+    blocking_budget: Optional[float]
     blocking_output: bool
-    ignore_messages_when_busy: bool
-    task_container: TaskContainer = TaskContainer()
-    # This Set is not thread safe. However, sanic is not multithreaded.
-    ignore_messages_for: set[Text] = set()
+    # One of the BUSY_MODES
+    ignore_messages_when_busy: Text
+    # Dialogs with a turn running in this process, with the newest message that arrived in the meantime (if any)
+    # and whether it supersedes the speech of earlier turns
+    pending_messages: Dict[Text, Optional[Tuple[UserMessage, bool]]]
+    session_pool: ClientSessionPool
+    retry_policy: RetryPolicy
+    circuit_breakers: CircuitBreakerRegistry
+    task_container: TaskContainer
+    shutdown_timeout: float
+    busy_dialogs: BusyDialogStore
+    compact_recipient_ids: bool
+    say_separator: Optional[Text]
+    dialog_sessions: DialogSessionRegistry
+    deduplication_window: float
+    deduplication_limit: int
+    metrics_enabled: bool
+    metrics_token: Optional[Text]
+    outbox: Optional[Outbox]
+    metadata_projections: MetadataProjections
+    command_queue: DialogCommandQueue
 
     @classmethod
     def name(cls) -> Text:
@@ -292,44 +1046,230 @@ class CVGInput(InputChannel):
             blocking_endpoints = True
         else:
             blocking_endpoints = bool(blocking_endpoints)
-        blocking_output = credentials.get("blocking_endpoints")
+        # Only used with blocking_endpoints: the number of seconds to wait for the bot before acknowledging the request
+        # and letting the bot finish in the background. Without a budget the request waits until the bot is done.
+        blocking_budget = get_credential(credentials, "blocking_budget", None, float)
+        if blocking_budget is not None and blocking_budget <= 0:
+            blocking_budget = None
+        blocking_output = credentials.get("blocking_output")
         if blocking_output is None:
             blocking_output = True
         else:
             blocking_output = bool(blocking_output)
 
-        ignore_messages_when_busy = credentials.get("ignore_messages_when_busy")
-        if ignore_messages_when_busy is None:
-            ignore_messages_when_busy = False
-        else:
-            ignore_messages_when_busy = bool(ignore_messages_when_busy)
+        ignore_messages_when_busy = parse_busy_mode(credentials.get("ignore_messages_when_busy"))
+
+        # Sender ids are the keys of the tracker store, so changing this option starts new trackers for ongoing dialogs
+        compact_recipient_ids = get_credential(credentials, "compact_recipient_ids", False, bool)
+
+        # The metrics are served in the Prometheus text format on the metrics route of the webhook
+        metrics_enabled = get_credential(credentials, "metrics", False, bool)
+        metrics_token = credentials.get("metrics_token")
+
+        # Structured logging emits every record as JSON, sampling drops the given fraction of the records of a level
+        structured_logging = get_credential(credentials, "structured_logging", False, bool)
+        log_sample_rates = parse_sample_rates(credentials.get("log_sample_rates"))
+        log_redact_secrets = get_credential(credentials, "log_redact_secrets", True, bool)
+        log_payload_max_length = get_credential(credentials, "log_payload_max_length", 1000, int)
+        configure_logging(structured_logging, log_sample_rates, log_redact_secrets, log_payload_max_length)
 
-        logger.info(f"Creating input with: token={'*' * len(token)} proxy={proxy} start_intent={start_intent} blocking_endpoints={blocking_endpoints} blocking_output={blocking_output} ignore_messages_when_busy={ignore_messages_when_busy}")
-        return cls(token, start_intent, proxy, blocking_endpoints, blocking_output, ignore_messages_when_busy)
+        coalesce_say = get_credential(credentials, "coalesce_say", False, bool)
+        say_separator = get_credential(credentials, "say_separator", " ", str) if coalesce_say else None
 
-    def __init__(self, token: Text, start_intent: Text, proxy: Optional[Text], blocking_endpoints: bool, blocking_output: bool, ignore_messages_when_busy: bool) -> None:
+        dialog_sessions = DialogSessionRegistry(
+            get_credential(credentials, "dialog_session_limit", 10000, int),
+            get_credential(credentials, "dialog_session_ttl", 3600.0, float),
+        )
+        # A window of 0 disables the deduplication of redelivered requests
+        deduplication_window = get_credential(credentials, "deduplication_window", 60.0, float)
+        deduplication_limit = get_credential(credentials, "deduplication_limit", 32, int)
+
+        http_limit = get_credential(credentials, "http_limit", 100, int)
+        http_limit_per_host = get_credential(credentials, "http_limit_per_host", 0, int)
+        # A value of 0 disables the DNS cache
+        http_dns_cache_ttl = get_credential(credentials, "http_dns_cache_ttl", 10, int)
+        http_keepalive_timeout = get_credential(credentials, "http_keepalive_timeout", 15.0, float)
+        session_pool = ClientSessionPool(
+            http_limit,
+            http_limit_per_host,
+            http_dns_cache_ttl if http_dns_cache_ttl > 0 else None,
+            http_keepalive_timeout,
+        )
+
+        retry_policy = RetryPolicy(
+            get_credential(credentials, "retry_max_retries", 3, int),
+            get_credential(credentials, "retry_backoff_base", 0.1, float),
+            get_credential(credentials, "retry_backoff_max", 2.0, float),
+            get_credential(credentials, "retry_jitter", 0.5, float),
+            get_credential(credentials, "request_timeout", 10.0, float),
+            get_credential(credentials, "outbound_call_timeout", 600.0, float),
+        )
+        # A threshold of 0 disables the circuit breaker
+        circuit_breakers = CircuitBreakerRegistry(
+            get_credential(credentials, "circuit_breaker_failure_threshold", 5, int),
+            get_credential(credentials, "circuit_breaker_reset_timeout", 30.0, float),
+        )
+
+        # A limit of 0 allows an unlimited number of concurrent background tasks
+        task_container = TaskContainer(
+            get_credential(credentials, "max_background_tasks", 0, int),
+            get_credential(credentials, "max_queued_background_tasks", 1000, int),
+        )
+        shutdown_timeout = get_credential(credentials, "shutdown_timeout", 10.0, float)
+
+        # The memory store only works with a single Rasa instance and Sanic worker, use sqlite or redis to scale out
+        busy_dialog_store = get_credential(credentials, "busy_dialog_store", "memory", str)
+        busy_dialog_ttl = get_credential(credentials, "busy_dialog_ttl", 120.0, float)
+        busy_dialogs = create_busy_dialog_store(
+            busy_dialog_store,
+            busy_dialog_ttl,
+            credentials.get("busy_dialog_store_path"),
+            credentials.get("busy_dialog_store_url"),
+        )
+
+        # The outbox keeps critical commands (call_forward, dialog_data and dialog_delete) until CVG received them.
+        # The memory outbox survives network failures, the sqlite outbox also survives restarts.
+        outbox_kind = get_credential(credentials, "outbox", "none", str)
+        outbox_ttl = get_credential(credentials, "outbox_ttl", 300.0, float)
+        outbox_batch_size = get_credential(credentials, "outbox_batch_size", 100, int)
+        outbox_flush_interval = get_credential(credentials, "outbox_flush_interval", 0.05, float)
+        outbox_retry_interval = get_credential(credentials, "outbox_retry_interval", 1.0, float)
+        outbox_retry_max_interval = get_credential(credentials, "outbox_retry_max_interval", 30.0, float)
+        outbox = create_outbox(
+            outbox_kind,
+            credentials.get("outbox_path"),
+            outbox_ttl,
+            OUTBOX_RETRYABLE_STATUS_CODES,
+            outbox_batch_size,
+            outbox_flush_interval,
+            outbox_retry_interval,
+            outbox_retry_max_interval,
+        )
+
+        # Every user message carries its projected payload in its metadata, which is stored in the tracker
+        metadata_drop_secrets = get_credential(credentials, "metadata_drop_secrets", False, bool)
+        metadata_projections = MetadataProjections.parse(credentials.get("metadata_fields"), metadata_drop_secrets)
+
+        logger.info(f"Creating input with: token={'*' * len(token)} proxy={proxy} start_intent={start_intent} blocking_endpoints={blocking_endpoints} blocking_budget={blocking_budget} blocking_output={blocking_output} ignore_messages_when_busy={ignore_messages_when_busy} http_limit={http_limit} http_limit_per_host={http_limit_per_host} http_dns_cache_ttl={http_dns_cache_ttl} http_keepalive_timeout={http_keepalive_timeout}")
+        logger.info(f"Outbound requests use {retry_policy} circuit_breaker_failure_threshold={circuit_breakers.failure_threshold} circuit_breaker_reset_timeout={circuit_breakers.reset_timeout}")
+        logger.info(f"Background tasks use: max_background_tasks={task_container.max_tasks} max_queued_background_tasks={task_container.max_queued} shutdown_timeout={shutdown_timeout}")
+        logger.info(f"Busy dialogs are tracked with: busy_dialog_store={busy_dialog_store} busy_dialog_ttl={busy_dialog_ttl}")
+        logger.info(f"Critical commands use: outbox={outbox_kind} outbox_ttl={outbox_ttl} outbox_batch_size={outbox_batch_size} outbox_flush_interval={outbox_flush_interval} outbox_retry_interval={outbox_retry_interval} outbox_retry_max_interval={outbox_retry_max_interval}")
+        logger.info(f"Metadata uses: metadata_fields={credentials.get('metadata_fields')} metadata_drop_secrets={metadata_drop_secrets}")
+        logger.info(f"Sender ids use: compact_recipient_ids={compact_recipient_ids}")
+        logger.info(f"Texts are said with: coalesce_say={coalesce_say} say_separator={say_separator!r}")
+        logger.info(f"Dialog sessions use: dialog_session_limit={dialog_sessions.max_sessions} dialog_session_ttl={dialog_sessions.ttl} deduplication_window={deduplication_window} deduplication_limit={deduplication_limit}")
+        logger.info(f"Metrics use: metrics={metrics_enabled} metrics_token={'*' * len(metrics_token or '')}")
+        logger.info(f"Logging uses: structured_logging={structured_logging} log_sample_rates={credentials.get('log_sample_rates')} log_redact_secrets={log_redact_secrets} log_payload_max_length={log_payload_max_length}")
+        return cls(token, start_intent, proxy, blocking_endpoints, blocking_output, ignore_messages_when_busy, session_pool, retry_policy, circuit_breakers, task_container, shutdown_timeout, busy_dialogs, compact_recipient_ids, say_separator, metrics_enabled, metrics_token, dialog_sessions, deduplication_window, deduplication_limit, blocking_budget, outbox, metadata_projections)
+
+    def __init__(self, token: Text, start_intent: Text, proxy: Optional[Text], blocking_endpoints: bool, blocking_output: bool, ignore_messages_when_busy: Any, session_pool: Optional[ClientSessionPool] = None, retry_policy: Optional[RetryPolicy] = None, circuit_breakers: Optional[CircuitBreakerRegistry] = None, task_container: Optional[TaskContainer] = None, shutdown_timeout: float = 10.0, busy_dialogs: Optional[BusyDialogStore] = None, compact_recipient_ids: bool = False, say_separator: Optional[Text] = None, metrics_enabled: bool = False, metrics_token: Optional[Text] = None, dialog_sessions: Optional[DialogSessionRegistry] = None, deduplication_window: float = 60.0, deduplication_limit: int = 32, blocking_budget: Optional[float] = None, outbox: Optional[Outbox] = None, metadata_projections: Optional[MetadataProjections] = None) -> None:
         self.callback = None
         self.expected_authorization_header_value = f"Bearer {token}"
         self.proxy = proxy
         self.start_intent = start_intent
         self.blocking_endpoints = blocking_endpoints
+        self.blocking_budget = blocking_budget
         self.blocking_output = blocking_output
-        self.ignore_messages_when_busy = ignore_messages_when_busy
+        self.ignore_messages_when_busy = parse_busy_mode(ignore_messages_when_busy)
+        self.pending_messages = {}
+        self.command_queue = DialogCommandQueue()
+        if session_pool is None:
+            session_pool = ClientSessionPool()
+        self.session_pool = session_pool
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+        if circuit_breakers is None:
+            circuit_breakers = CircuitBreakerRegistry()
+        self.circuit_breakers = circuit_breakers
+        if task_container is None:
+            task_container = TaskContainer()
+        self.task_container = task_container
+        self.shutdown_timeout = shutdown_timeout
+        if busy_dialogs is None:
+            busy_dialogs = InMemoryBusyDialogStore(120.0)
+        self.busy_dialogs = busy_dialogs
+        self.compact_recipient_ids = compact_recipient_ids
+        self.say_separator = say_separator
+        self.metrics_enabled = metrics_enabled
+        self.metrics_token = metrics_token
+        if dialog_sessions is None:
+            dialog_sessions = DialogSessionRegistry()
+        self.dialog_sessions = dialog_sessions
+        self.deduplication_window = deduplication_window
+        self.deduplication_limit = deduplication_limit
+        self.outbox = outbox
+        if metadata_projections is None:
+            metadata_projections = MetadataProjections()
+        self.metadata_projections = metadata_projections
+
+    def _create_output(self, callback: Text, auth_token: Text, on_new_message: Callable[[UserMessage], Awaitable[Any]]) -> CVGOutput:
+        return CVGOutput(
+            callback,
+            auth_token,
+            on_new_message,
+            self.proxy,
+            self.task_container,
+            self.blocking_output,
+            self.session_pool,
+            self.command_queue,
+            self.retry_policy,
+            self.circuit_breakers,
+            self.say_separator,
+            self.outbox,
+            self.metadata_projections,
+        )
+
+    def _get_session(self, payload: WebhookRequest, on_new_message: Callable[[UserMessage], Awaitable[Any]]) -> DialogSession:
+        session = self.dialog_sessions.get(payload.dialog_id)
+        if session is not None and session.callback == payload.callback and session.auth_token == payload.auth_token:
+            return session
 
-    async def _process_message(self, request: Request, on_new_message: Callable[[UserMessage], Awaitable[Any]], dialog_id: Text, text: Text, sender_id: Text) -> Any:
+        sender_id = create_recipient_id(
+            payload.reseller_token,
+            payload.project_token,
+            payload.dialog_id,
+            self.compact_recipient_ids,
+        )
+        cvg_output = self._create_output(payload.callback, payload.auth_token, on_new_message)
+        session = DialogSession(payload.dialog_id, sender_id, payload.callback, payload.auth_token, cvg_output)
+        self.dialog_sessions.add(session)
+        return session
+
+    # CVG delivers a request again if it did not receive our response in time. Such a redelivery has the same timestamp,
+    # requests without a timestamp cannot be told apart from a legitimate repetition and are always processed.
+    def _request_fingerprint(self, payload: WebhookRequest, text: Text) -> Optional[Tuple]:
+        timestamp = payload.body.get(TIMESTAMP_FIELD)
+        if self.deduplication_window <= 0 or timestamp is None:
+            return None
+        return payload.ROUTE, timestamp, text
+
+    def _is_redelivery(self, session: DialogSession, fingerprint: Optional[Tuple]) -> bool:
+        if fingerprint is None:
+            return False
+        return session.is_duplicate(fingerprint, self.deduplication_window, self.deduplication_limit, time.monotonic())
+
+    # Commands left in the outbox by an earlier process are sent through the dialog's command queue, like all other commands
+    async def _deliver_from_outbox(self, command: OutboxCommand, on_new_message: Callable[[UserMessage], Awaitable[Any]]) -> Tuple[int, Any]:
+        session = self.dialog_sessions.get(command.dialog_id)
+        if session is not None and session.callback == command.callback and session.auth_token == command.auth_token:
+            cvg_output = session.output
+        else:
+            # The dialog is not known (anymore), e.g. after a restart
+            cvg_output = self._create_output(command.callback, command.auth_token, on_new_message)
+        return await self.command_queue.submit(command.dialog_id, cvg_output._send_command(command), detached=command.path in OUTBOUND_CALL_PATHS)
+
+    async def _process_message(self, payload: WebhookRequest, session: DialogSession, on_new_message: Callable[[UserMessage], Awaitable[Any]], text: Text) -> Any:
+        dialog_id = payload.dialog_id
+        sender_id = session.sender_id
         try:
             if text[-1] == ".":
                 text = text[:-1]
 
-            metadata = make_metadata(request.json)
-            cvg_output = CVGOutput(
-                request.json[CALLBACK_FIELD],
-                request.json[AUTH_TOKEN_FIELD],
-                on_new_message,
-                self.proxy,
-                self.task_container,
-                self.blocking_output
-            )
+            supersede = payload.ROUTE in SUPERSEDING_ROUTES
+            metadata = make_metadata(self.metadata_projections.apply(payload.ROUTE, payload.body))
+            cvg_output = session.output
             user_msg = UserMessage(
                 text=text,
                 output_channel=cvg_output,
@@ -338,113 +1278,289 @@ class CVGInput(InputChannel):
                 metadata=metadata,
             )
 
-            # Ignore Messages when busy uses a local variable to check if there is already a message being processed.
-            # This means that this feature does NOT work with multiple instances of this channel/rasa handling the same sender_id.
-            if (self.ignore_messages_when_busy):
-                if (dialog_id in self.ignore_messages_for):
-                    logger.warning(f"{dialog_id} - A message is already being processed for this dialog and ignore_messages_when_busy is True. Ignoring message from User: '{text}'")
+            # The lease expires after busy_dialog_ttl, so a turn that never completes cannot lock the dialog forever.
+            lease = None
+            if self.ignore_messages_when_busy != "off":
+                busy = False
+                try:
+                    lease = await self.busy_dialogs.acquire(dialog_id)
+                    busy = lease is None
+                except Exception as e:
+                    # Dropping the message would be worse than processing it concurrently with another one
+                    logger.error("%s - Failed to check whether the dialog is busy, processing the message anyway: %s", dialog_id, e, exc_info=True, extra={"dialog_id": dialog_id})
+                if busy:
+                    # Only a turn running in this process can pick up the pending message, otherwise it is ignored
+                    if self.ignore_messages_when_busy == "latest" and dialog_id in self.pending_messages:
+                        if self.pending_messages[dialog_id] is not None:
+                            logger.info("%s - Replacing the pending message of this dialog with the newer message from User: '%s'", dialog_id, text, extra={"dialog_id": dialog_id})
+                            metrics.BUSY_MESSAGES_REPLACED.inc()
+                        else:
+                            logger.info("%s - A message is already being processed for this dialog, processing the message from User afterwards: '%s'", dialog_id, text, extra={"dialog_id": dialog_id})
+                        self.pending_messages[dialog_id] = (user_msg, supersede)
+                        return response.empty(204)
+                    logger.warning("%s - A message is already being processed for this dialog and ignore_messages_when_busy is enabled. Ignoring message from User: '%s'", dialog_id, text, extra={"dialog_id": dialog_id})
+                    metrics.BUSY_MESSAGES_DROPPED.inc()
                     return response.empty(204)
-                else:
-                    self.ignore_messages_for.add(dialog_id)
 
-            logger.info(f"{dialog_id} - Creating incoming UserMessage: text={text}, output_channel={user_msg.output_channel}, sender_id={sender_id}, metadata={metadata}")
+            # Without a lease the busy dialog store failed, the pending slot may then belong to another turn
+            owns_slot = self.ignore_messages_when_busy == "latest" and lease is not None
+            if owns_slot:
+                self.pending_messages[dialog_id] = None
+            handed_over = False
             try:
-                await on_new_message(user_msg)
+                await self._run_turn(dialog_id, on_new_message, user_msg, supersede)
+                # This request is answered after its own turn, the message that arrived in the meantime takes over the lease
+                if owns_slot and self.pending_messages.get(dialog_id) is not None:
+                    self.task_container.run(self._run_pending_turns(dialog_id, on_new_message, lease), bounded=False)
+                    handed_over = True
             finally:
-                if self.ignore_messages_when_busy:
-                    self.ignore_messages_for.remove(dialog_id)
+                if owns_slot and not handed_over:
+                    await self._release_slot(dialog_id, on_new_message, lease)
+                elif lease is not None and not handed_over:
+                    await self._release_lease(dialog_id, lease)
         except Exception as e:
-            logger.error(f"{dialog_id} - Exception when trying to handle message: {e}")
-            logger.error(e, exc_info=True)
+            logger.error("%s - Exception when trying to handle message: %s", dialog_id, e, exc_info=True, extra={"dialog_id": dialog_id})
 
         return response.empty(204)
 
+    async def _run_pending_turns(self, dialog_id: Text, on_new_message: Callable[[UserMessage], Awaitable[Any]], lease: Optional[Text]):
+        try:
+            pending = self.pending_messages.get(dialog_id)
+            while pending is not None:
+                user_msg, supersede = pending
+                self.pending_messages[dialog_id] = None
+                # Every turn may take up to busy_dialog_ttl, so a chain of turns does not outlive the lease
+                if lease is not None and not await self._renew_lease(dialog_id, lease):
+                    logger.warning("%s - The dialog has become busy elsewhere. Ignoring message from User: '%s'", dialog_id, user_msg.text, extra={"dialog_id": dialog_id})
+                    metrics.BUSY_MESSAGES_DROPPED.inc()
+                    lease = None
+                    return
+                try:
+                    await self._run_turn(dialog_id, on_new_message, user_msg, supersede)
+                except Exception as e:
+                    logger.error("%s - Exception when trying to handle message: %s", dialog_id, e, exc_info=True, extra={"dialog_id": dialog_id})
+                pending = self.pending_messages.get(dialog_id)
+        finally:
+            await self._release_slot(dialog_id, on_new_message, lease)
+
+    # The pending slot is kept until the lease has been released, a message arriving in the meantime would be dropped otherwise.
+    # Such a message is processed with a new lease.
+    async def _release_slot(self, dialog_id: Text, on_new_message: Callable[[UserMessage], Awaitable[Any]], lease: Optional[Text]):
+        if lease is not None:
+            await self._release_lease(dialog_id, lease)
+        pending = self.pending_messages.pop(dialog_id, None)
+        if pending is not None:
+            self.task_container.run(self._resume_pending_turns(dialog_id, on_new_message, pending), bounded=False)
+
+    async def _resume_pending_turns(self, dialog_id: Text, on_new_message: Callable[[UserMessage], Awaitable[Any]], pending: Tuple[UserMessage, bool]):
+        user_msg, supersede = pending
+        try:
+            lease = await self.busy_dialogs.acquire(dialog_id)
+        except Exception as e:
+            logger.error("%s - Failed to check whether the dialog is busy, processing the message anyway: %s", dialog_id, e, exc_info=True, extra={"dialog_id": dialog_id})
+            try:
+                await self._run_turn(dialog_id, on_new_message, user_msg, supersede)
+            except Exception as e:
+                logger.error("%s - Exception when trying to handle message: %s", dialog_id, e, exc_info=True, extra={"dialog_id": dialog_id})
+            return
+        if lease is None:
+            logger.warning("%s - The dialog has become busy again. Ignoring message from User: '%s'", dialog_id, user_msg.text, extra={"dialog_id": dialog_id})
+            metrics.BUSY_MESSAGES_DROPPED.inc()
+            return
+        self.pending_messages[dialog_id] = pending
+        await self._run_pending_turns(dialog_id, on_new_message, lease)
+
+    async def _renew_lease(self, dialog_id: Text, lease: Text) -> bool:
+        try:
+            return await self.busy_dialogs.renew(dialog_id, lease)
+        except Exception as e:
+            # Like a failing acquire, the message is processed rather than dropped
+            logger.error("%s - Failed to renew the busy dialog, processing the message anyway: %s", dialog_id, e, exc_info=True, extra={"dialog_id": dialog_id})
+            return True
+
+    async def _release_lease(self, dialog_id: Text, lease: Text):
+        try:
+            await self.busy_dialogs.release(dialog_id, lease)
+        except Exception as e:
+            logger.error("%s - Failed to release the busy dialog, retrying in the background: %s", dialog_id, e, extra={"dialog_id": dialog_id})
+            self.task_container.run(self._retry_release_lease(dialog_id, lease), bounded=False)
+
+    # Until the lease is released, further messages of the dialog are ignored for up to busy_dialog_ttl
+    async def _retry_release_lease(self, dialog_id: Text, lease: Text):
+        for attempt in range(self.retry_policy.max_retries):
+            await asyncio.sleep(self.retry_policy.backoff(attempt))
+            try:
+                await self.busy_dialogs.release(dialog_id, lease)
+                return
+            except Exception as e:
+                logger.error("%s - Failed to release the busy dialog: %s", dialog_id, e, extra={"dialog_id": dialog_id})
+        logger.error("%s - Giving up releasing the busy dialog, it stays busy until its lease expires after %ss", dialog_id, self.busy_dialogs.ttl, extra={"dialog_id": dialog_id})
+
+    async def _run_turn(self, dialog_id: Text, on_new_message: Callable[[UserMessage], Awaitable[Any]], user_msg: UserMessage, supersede: bool):
+        cvg_output = user_msg.output_channel
+        logger.info("%s - Creating incoming UserMessage: text=%s, sender_id=%s, metadata=%s", dialog_id, user_msg.text, user_msg.sender_id, LazyPayload(user_msg.metadata), extra={"dialog_id": dialog_id})
+        # The commands sent while processing a new message belong to a new turn, which supersedes the speech of earlier turns.
+        # Other events, like a recording or inactivity, speak as part of the current turn.
+        turn = CURRENT_TURN.set(cvg_output.start_turn(dialog_id) if supersede else cvg_output.turn)
+        start = time.perf_counter()
+        try:
+            await on_new_message(user_msg)
+        finally:
+            metrics.TURN_DURATION.observe(time.perf_counter() - start)
+            await cvg_output.flush()
+            CURRENT_TURN.reset(turn)
+
     def blueprint(self, on_new_message: Callable[[UserMessage], Awaitable[Any]]) -> Blueprint:
-        def valid_request(func):
+        def valid_request(payload_type: Type[WebhookRequest]):
             def decorator(f):
+                route = f.__name__
+
                 @wraps(f)
-                async def decorated_function(request: HTTPResponse, *args, **kwargs):
+                async def decorated_function(request: Request, *args, **kwargs):
+                    start = time.perf_counter()
+                    status = 500
+                    try:
+                        result = await validate_and_handle(request, *args, **kwargs)
+                        status = result.status
+                        return result
+                    finally:
+                        duration = time.perf_counter() - start
+                        metrics.WEBHOOK_REQUESTS.inc(route, str(status))
+                        metrics.WEBHOOK_DURATION.observe(duration, route)
+                        logger.info("Handled %s request: status=%s", route, status, extra={"route": route, "status": status, "duration": duration})
+
+                async def validate_and_handle(request: Request, *args, **kwargs):
                     if request.headers.get("authorization") != self.expected_authorization_header_value:
                         return response.text("bot token is invalid!", status=401)
 
                     if not request.headers.get("content-type") == "application/json":
                         return response.text("content-type is not supported. Please use application/json", status=415)
-                    json_body = request.json
-                    if json_body is None:
-                        return response.text("body is not valid json.", status=400)
-                    if json_body[DIALOG_ID_FIELD] is None:
-                        return response.text(f"{DIALOG_ID_FIELD} is required", status=400)
-                    if json_body[CALLBACK_FIELD] is None:
-                        return response.text(f"{CALLBACK_FIELD} is required", status=400)
-                    if PROJECT_CONTEXT_FIELD not in json_body:
-                        return response.text(f"{PROJECT_CONTEXT_FIELD} is required", status=400)
-                    else:
-                        project_context = json_body[PROJECT_CONTEXT_FIELD]
-                        if RESELLER_TOKEN_FIELD not in project_context:
-                            return response.text(f'The {RESELLER_TOKEN_FIELD} is required in {PROJECT_CONTEXT_FIELD}!')
-                        if PROJECT_TOKEN_FIELD not in project_context:
-                            return response.text(f'The {PROJECT_TOKEN_FIELD} is required in {PROJECT_CONTEXT_FIELD}!')
-
-                    return await f(request, *args, **kwargs)
+
+                    # The body is parsed and validated exactly once, handlers only work with the resulting payload
+                    try:
+                        payload = payload_type.parse(request.body)
+                    except InvalidPayload as e:
+                        return response.text(str(e), status=400)
+
+                    return await f(request, payload, *args, **kwargs)
                 return decorated_function
-            return decorator(func)
-
-        async def _process_request(request: Request, text: Text, must_block: bool):
-            dialog_id = request.json[DIALOG_ID_FIELD]
-            sender_id = create_recipient_id(
-                request.json[PROJECT_CONTEXT_FIELD][RESELLER_TOKEN_FIELD],
-                request.json[PROJECT_CONTEXT_FIELD][PROJECT_TOKEN_FIELD],
-                dialog_id
-            )
+            return decorator
+
+        async def _process_request(payload: WebhookRequest, text: Text, must_block: bool):
+            dialog_id = payload.dialog_id
+            session = self._get_session(payload, on_new_message)
+
+            fingerprint = self._request_fingerprint(payload, text)
+            if self._is_redelivery(session, fingerprint):
+                logger.info("%s - Ignoring %s request that has been delivered again: text=%s", dialog_id, payload.ROUTE, text, extra={"dialog_id": dialog_id, "route": payload.ROUTE})
+                metrics.DUPLICATE_REQUESTS.inc(payload.ROUTE)
+                return response.empty(204)
 
             result = self._process_message(
-                request,
+                payload,
+                session,
                 on_new_message,
-                dialog_id,
                 text,
-                sender_id,
             )
 
-            if self.blocking_endpoints or must_block:
+            if must_block or (self.blocking_endpoints and self.blocking_budget is None):
                 await result
+            elif self.blocking_endpoints:
+                # The turn is started right away, so it does not wait for a free slot after the budget has been used up
+                turn = self.task_container.run(result, bounded=False)
+                done, _ = await asyncio.wait({turn}, timeout=self.blocking_budget)
+                if not done:
+                    logger.info("%s - The bot did not respond within %ss, continuing in the background", dialog_id, self.blocking_budget, extra={"dialog_id": dialog_id, "route": payload.ROUTE})
+                    metrics.BLOCKING_BUDGET_EXCEEDED.inc(payload.ROUTE)
             else:
-                self.task_container.run(result)
+                try:
+                    self.task_container.run(result)
+                except TaskContainerFull as e:
+                    # CVG delivers the rejected request again, which must not be mistaken for a duplicate
+                    if fingerprint is not None:
+                        session.forget(fingerprint)
+                    logger.error("%s - Rejecting request, too many requests are being processed: %s", dialog_id, e, extra={"dialog_id": dialog_id, "route": payload.ROUTE, "status": 503})
+                    return response.text("too many requests are being processed", status=503, headers={"Retry-After": "1"})
 
             return response.empty(204)
-            
+
         cvg_webhook = Blueprint(
             "vier_cvg_webhook", __name__,
         )
 
+        metrics.REGISTRY.gauge("cvg_background_tasks", "Background tasks currently running.", lambda: len(self.task_container.tasks))
+        metrics.REGISTRY.gauge("cvg_background_tasks_queued", "Background tasks waiting for a free slot.", lambda: self.task_container.queue_depth)
+        metrics.REGISTRY.gauge("cvg_outbound_dialog_queues", "Dialogs with commands waiting to be sent to CVG.", lambda: len(self.command_queue.queues))
+        metrics.REGISTRY.gauge("cvg_dialog_sessions", "Active dialogs held by the session registry.", lambda: len(self.dialog_sessions))
+        metrics.REGISTRY.gauge("cvg_busy_dialogs", "Dialogs with a message being processed.", self.busy_dialogs.count)
+        metrics.REGISTRY.gauge(
+            "cvg_circuit_breaker_open",
+            "Whether requests to a CVG host are currently failing fast.",
+            lambda: {(host,): 0 if state == CircuitBreaker.CLOSED else 1 for host, state in self.circuit_breakers.states().items()},
+            ("host",),
+        )
+        if self.outbox is not None:
+            metrics.REGISTRY.gauge("cvg_outbox_backlog", "Commands in the outbox waiting to be delivered to CVG.", lambda: self.outbox.backlog)
+
+        if self.metrics_enabled:
+            @cvg_webhook.get("/metrics")
+            async def metrics_endpoint(request: Request) -> HTTPResponse:
+                if self.metrics_token is not None and request.headers.get("authorization") != f"Bearer {self.metrics_token}":
+                    return response.text("metrics token is invalid!", status=401)
+                return response.text(await metrics.REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+        @cvg_webhook.listener("after_server_start")
+        async def start_outbox(app, loop):
+            if self.outbox is not None:
+                await self.outbox.start(lambda command: self._deliver_from_outbox(command, on_new_message))
+
+        @cvg_webhook.listener("before_server_stop")
+        async def drain_task_container(app, loop):
+            await self.task_container.drain(self.shutdown_timeout)
+
+        @cvg_webhook.listener("after_server_stop")
+        async def close_resources(app, loop):
+            # Undelivered commands stay in the outbox, so it must stop before the sessions it sends them with are closed
+            if self.outbox is not None:
+                await self.outbox.close()
+            await self.session_pool.close()
+            await self.busy_dialogs.close()
+
         @cvg_webhook.post("/session")
-        @valid_request
-        async def session(request: Request) -> HTTPResponse:
-            await _process_request(request, self.start_intent, True)
+        @valid_request(SessionRequest)
+        async def session(request: Request, payload: SessionRequest) -> HTTPResponse:
+            await _process_request(payload, self.start_intent, True)
             return response.json({"action": "ACCEPT"}, 200)
-        
+
         @cvg_webhook.post("/message")
-        @valid_request
-        async def message(request: Request) -> HTTPResponse:
-            return await _process_request(request, request.json["text"], False)
+        @valid_request(MessageRequest)
+        async def message(request: Request, payload: MessageRequest) -> HTTPResponse:
+            return await _process_request(payload, payload.text, False)
 
         @cvg_webhook.post("/answer")
-        @valid_request
-        async def answer(request: Request) -> HTTPResponse:
-            return await _process_request(request, "/cvg_answer_" + request.json["type"]["name"].lower(), False)
+        @valid_request(AnswerRequest)
+        async def answer(request: Request, payload: AnswerRequest) -> HTTPResponse:
+            return await _process_request(payload, "/cvg_answer_" + payload.answer_type.lower(), False)
 
         @cvg_webhook.post("/inactivity")
-        @valid_request
-        async def inactivity(request: Request) -> HTTPResponse:
-            return await _process_request(request, "/cvg_inactivity", False)
+        @valid_request(InactivityRequest)
+        async def inactivity(request: Request, payload: InactivityRequest) -> HTTPResponse:
+            return await _process_request(payload, "/cvg_inactivity", False)
 
         @cvg_webhook.post("/terminated")
-        @valid_request
-        async def terminated(request: Request) -> HTTPResponse:
-            return await _process_request(request, "/cvg_terminated", False)
+        @valid_request(TerminatedRequest)
+        async def terminated(request: Request, payload: TerminatedRequest) -> HTTPResponse:
+            result = await _process_request(payload, "/cvg_terminated", False)
+            # The turn keeps its own reference to the session, so it can be removed while the turn is still running
+            session = self.dialog_sessions.remove(payload.dialog_id, self.deduplication_window)
+            if session is not None:
+                # Nobody is listening anymore, so all pending speech of the dialog is cancelled
+                session.output.start_turn(payload.dialog_id)
+            return result
 
         @cvg_webhook.post("/recording")
-        @valid_request
-        async def recording(request: Request) -> HTTPResponse:
-            return await _process_request(request, "/cvg_recording", False)
+        @valid_request(RecordingRequest)
+        async def recording(request: Request, payload: RecordingRequest) -> HTTPResponse:
+            return await _process_request(payload, "/cvg_recording", False)
 
         return cvg_webhook
@@ -0,0 +1,116 @@
+import json
+import logging
+import random
+from typing import Any, Dict, List, Optional, Text
+
+PACKAGE_LOGGER_NAME = "rasa_vier_cvg"
+
+# These fields are attached to log records via `extra` and become top level fields of the structured records
+STRUCTURED_FIELDS = ("dialog_id", "route", "operation", "status", "duration")
+
+SECRET_FIELDS = frozenset(["authToken", "resellerToken", "projectToken", "Authorization", "authorization"])
+REDACTED = "***"
+
+
+class PayloadSettings:
+    redact_secrets: bool = True
+    max_length: int = 1000
+
+
+def redact(payload: Any) -> Any:
+    if isinstance(payload, dict):
+        return {key: REDACTED if key in SECRET_FIELDS else redact(value) for key, value in payload.items()}
+    if isinstance(payload, list):
+        return [redact(value) for value in payload]
+    return payload
+
+
+class LazyPayload:
+    """Defers serializing, redacting and truncating a payload until a log record is actually emitted"""
+
+    __slots__ = ("payload",)
+
+    def __init__(self, payload: Any) -> None:
+        self.payload = payload
+
+    def __str__(self) -> str:
+        payload = redact(self.payload) if PayloadSettings.redact_secrets else self.payload
+        try:
+            text = json.dumps(payload, default=str, ensure_ascii=False)
+        except ValueError:
+            text = str(payload)
+        if 0 < PayloadSettings.max_length < len(text):
+            return f"{text[:PayloadSettings.max_length]}...({len(text) - PayloadSettings.max_length} more characters)"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats every record as a single line of JSON with the fixed fields of STRUCTURED_FIELDS"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Only lets the configured fraction of the records of a level pass, levels without a rate are not sampled"""
+
+    rates: Dict[int, float]
+
+    def __init__(self, rates: Dict[int, float]) -> None:
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno)
+        return rate is None or random.random() < rate
+
+
+def parse_sample_rates(rates: Optional[Dict[Text, Any]]) -> Dict[int, float]:
+    if not rates:
+        return {}
+    parsed = {}
+    for level_name, rate in rates.items():
+        level = logging.getLevelName(str(level_name).upper())
+        if not isinstance(level, int):
+            raise ValueError(f'Unknown log level {level_name} in log_sample_rates!')
+        parsed[level] = float(rate)
+    return parsed
+
+
+def package_loggers() -> List[logging.Logger]:
+    """Returns the loggers of the package and all of its modules that have been imported so far"""
+    names = [name for name in logging.root.manager.loggerDict if name == PACKAGE_LOGGER_NAME or name.startswith(PACKAGE_LOGGER_NAME + ".")]
+    return [logging.getLogger(name) for name in names]
+
+
+def configure_logging(structured: bool, sample_rates: Dict[int, float], redact_secrets: bool, max_length: int):
+    PayloadSettings.redact_secrets = redact_secrets
+    PayloadSettings.max_length = max_length
+
+    # Filters of a logger do not apply to the records propagated from its children, so every module logger gets its own
+    for logger in package_loggers():
+        for existing in [f for f in logger.filters if isinstance(f, SamplingFilter)]:
+            logger.removeFilter(existing)
+        if sample_rates:
+            logger.addFilter(SamplingFilter(sample_rates))
+
+    if structured:
+        package_logger = logging.getLogger(PACKAGE_LOGGER_NAME)
+        if not any(isinstance(handler.formatter, JsonFormatter) for handler in package_logger.handlers):
+            handler = logging.StreamHandler()
+            handler.setFormatter(JsonFormatter())
+            package_logger.addHandler(handler)
+        # Otherwise the records would additionally be formatted by the handlers of rasa
+        package_logger.propagate = False
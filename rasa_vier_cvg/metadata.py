@@ -0,0 +1,102 @@
+from typing import Any, Dict, FrozenSet, Optional, Text
+
+from rasa_vier_cvg.logs import SECRET_FIELDS
+
+# The results of call_forward/call_bridge and call_refer are projected like the webhook routes
+OUTBOUND_ROUTE = "outbound"
+REFER_ROUTE = "refer"
+DEFAULT_ROUTE = "default"
+ROUTES = frozenset(["session", "message", "answer", "inactivity", "terminated", "recording", OUTBOUND_ROUTE, REFER_ROUTE, DEFAULT_ROUTE])
+
+
+def _without_secrets(value: Any) -> Any:
+    # Only the dicts that actually contain a secret are copied, everything else is shared with the payload
+    if isinstance(value, dict):
+        result = None
+        for key, item in value.items():
+            cleaned = None if key in SECRET_FIELDS else _without_secrets(item)
+            if key in SECRET_FIELDS or cleaned is not item:
+                if result is None:
+                    result = dict(value)
+                if key in SECRET_FIELDS:
+                    del result[key]
+                else:
+                    result[key] = cleaned
+        return value if result is None else result
+    if isinstance(value, list):
+        cleaned = [_without_secrets(item) for item in value]
+        if any(new is not old for new, old in zip(cleaned, value)):
+            return cleaned
+    return value
+
+
+class MetadataProjection:
+    """Selects the top level fields of a payload that are kept in the metadata of a user message"""
+
+    __slots__ = ("allow", "deny", "drop_secrets")
+
+    # None keeps all fields that are not denied
+    allow: Optional[FrozenSet[Text]]
+    deny: FrozenSet[Text]
+    drop_secrets: bool
+
+    def __init__(self, allow: Optional[FrozenSet[Text]] = None, deny: FrozenSet[Text] = frozenset(), drop_secrets: bool = False) -> None:
+        self.allow = allow
+        self.deny = deny
+        self.drop_secrets = drop_secrets
+
+    @property
+    def is_identity(self) -> bool:
+        return self.allow is None and not self.deny and not self.drop_secrets
+
+    def apply(self, payload: Any) -> Any:
+        """Returns the payload itself if nothing is removed, otherwise a new dict sharing the kept values with the payload"""
+        if self.is_identity or not isinstance(payload, dict):
+            return payload
+        result = {}
+        for key, value in payload.items():
+            if (self.allow is not None and key not in self.allow) or key in self.deny:
+                continue
+            if self.drop_secrets:
+                if key in SECRET_FIELDS:
+                    continue
+                value = _without_secrets(value)
+            result[key] = value
+        return result
+
+
+class MetadataProjections:
+    """The metadata projection of every route, routes without their own projection use the default one"""
+
+    projections: Dict[Text, MetadataProjection]
+    default: MetadataProjection
+
+    def __init__(self, projections: Optional[Dict[Text, MetadataProjection]] = None, default: Optional[MetadataProjection] = None) -> None:
+        self.projections = projections or {}
+        if default is None:
+            default = MetadataProjection()
+        self.default = default
+
+    def apply(self, route: Text, payload: Any) -> Any:
+        return self.projections.get(route, self.default).apply(payload)
+
+    @classmethod
+    def parse(cls, config: Optional[Dict[Text, Any]], drop_secrets: bool) -> "MetadataProjections":
+        projections = {}
+        for route, fields in (config or {}).items():
+            if route not in ROUTES:
+                raise ValueError(f'Unknown route {route} in metadata_fields, use one of: {", ".join(sorted(ROUTES))}')
+            if not isinstance(fields, dict) or not set(fields).issubset({"allow", "deny"}):
+                raise ValueError(f'The metadata_fields of {route} must have an allow and/or a deny list!')
+            allow = fields.get("allow")
+            deny = fields.get("deny") or []
+            for name, value in (("allow", allow), ("deny", deny)):
+                if value is not None and (not isinstance(value, list) or not all(isinstance(field, str) for field in value)):
+                    raise ValueError(f'The {name} list of {route} in metadata_fields must be a list of field names!')
+            projections[route] = MetadataProjection(
+                None if allow is None else frozenset(allow),
+                frozenset(deny),
+                drop_secrets,
+            )
+        default = projections.pop(DEFAULT_ROUTE, MetadataProjection(drop_secrets=drop_secrets))
+        return cls(projections, default)
@@ -0,0 +1,186 @@
+import inspect
+import logging
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Text, Tuple, Union
+
+# Latencies of webhook requests, bot turns and CVG requests range from a few milliseconds to several seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger(__name__)
+
+GaugeValue = Union[float, Dict[Tuple[Text, ...], float]]
+
+
+def _escape(value: Text) -> Text:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[Text], values: Sequence[Text], extra: Optional[Tuple[Text, Text]] = None) -> Text:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    if not pairs:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> Text:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric(ABC):
+    """Base class of the metrics, which are rendered in the Prometheus text format"""
+
+    type_name = "untyped"
+
+    name: Text
+    description: Text
+    label_names: Tuple[Text, ...]
+
+    def __init__(self, name: Text, description: Text, label_names: Sequence[Text] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+
+    def _header(self) -> List[Text]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type_name}"]
+
+    @abstractmethod
+    async def render(self) -> List[Text]:
+        """Returns the lines of this metric in the Prometheus text format."""
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    values: Dict[Tuple[Text, ...], float]
+
+    def __init__(self, name: Text, description: Text, label_names: Sequence[Text] = ()) -> None:
+        super().__init__(name, description, label_names)
+        self.values = {}
+
+    def inc(self, *labels: Text, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def get(self, *labels: Text) -> float:
+        return self.values.get(labels, 0.0)
+
+    async def render(self) -> List[Text]:
+        lines = self._header()
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    buckets: Tuple[float, ...]
+    # Per label set: the non-cumulative count of every bucket (the last one is +Inf), the sum and the count
+    values: Dict[Tuple[Text, ...], Tuple[List[int], List[float]]]
+
+    def __init__(self, name: Text, description: Text, label_names: Sequence[Text] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+
+    def observe(self, value: float, *labels: Text):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = ([0] * (len(self.buckets) + 1), [0.0])
+            self.values[labels] = entry
+        counts, total = entry
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    async def render(self) -> List[Text]:
+        lines = self._header()
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Gauge(Metric):
+    """A gauge whose value is read from a callback, which may be a coroutine function, when the metrics are rendered"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: Text, description: Text, callback: Callable[[], Union[GaugeValue, Awaitable[GaugeValue]]], label_names: Sequence[Text] = ()) -> None:
+        super().__init__(name, description, label_names)
+        self.callback = callback
+
+    async def render(self) -> List[Text]:
+        value = self.callback()
+        if inspect.isawaitable(value):
+            value = await value
+        if not isinstance(value, dict):
+            value = {(): value}
+        lines = self._header()
+        for labels, label_value in value.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(label_value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds all metrics of the process by name, registering a metric again replaces it.
+
+    A metric failing to render, e.g. a gauge whose callback cannot reach its store, is left out of the scrape and counted in scrape_errors.
+    """
+
+    metrics: Dict[Text, Metric]
+    scrape_errors: Counter
+
+    def __init__(self) -> None:
+        self.metrics = {}
+        self.scrape_errors = Counter("cvg_metrics_scrape_errors_total", "Metrics left out of a scrape, because reading their value failed.", ("metric",))
+
+    def register(self, metric: Metric) -> Any:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: Text, description: Text, label_names: Sequence[Text] = ()) -> Counter:
+        return self.register(Counter(name, description, label_names))
+
+    def histogram(self, name: Text, description: Text, label_names: Sequence[Text] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, description, label_names, buckets))
+
+    def gauge(self, name: Text, description: Text, callback: Callable[[], Union[GaugeValue, Awaitable[GaugeValue]]], label_names: Sequence[Text] = ()) -> Gauge:
+        return self.register(Gauge(name, description, callback, label_names))
+
+    async def render(self) -> Text:
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                lines.extend(await metric.render())
+            except Exception:
+                logger.exception("Rendering the metric %s failed, leaving it out", metric.name)
+                self.scrape_errors.inc(metric.name)
+        # Rendered last, so it includes the errors of this scrape
+        lines.extend(await self.scrape_errors.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+WEBHOOK_REQUESTS = REGISTRY.counter("cvg_webhook_requests_total", "Webhook requests received from CVG.", ("route", "status"))
+WEBHOOK_DURATION = REGISTRY.histogram("cvg_webhook_request_duration_seconds", "Time spent answering webhook requests from CVG.", ("route",))
+TURN_DURATION = REGISTRY.histogram("cvg_turn_duration_seconds", "Time spent in Rasa processing a message.")
+OUTBOUND_REQUESTS = REGISTRY.counter("cvg_outbound_requests_total", "Commands sent to CVG, status -1 means no response was received, -2 that CVG could not be reached.", ("operation", "status"))
+OUTBOUND_DURATION = REGISTRY.histogram("cvg_outbound_request_duration_seconds", "Time spent sending commands to CVG, including retries.", ("operation",))
+OUTBOUND_RETRIES = REGISTRY.counter("cvg_outbound_retries_total", "Retries of commands sent to CVG.", ("operation",))
+BUSY_MESSAGES_DROPPED = REGISTRY.counter("cvg_busy_messages_dropped_total", "Messages ignored because their dialog was busy.")
+DUPLICATE_REQUESTS = REGISTRY.counter("cvg_duplicate_requests_total", "Webhook requests redelivered by CVG and acknowledged without processing.", ("route",))
+BLOCKING_BUDGET_EXCEEDED = REGISTRY.counter("cvg_blocking_budget_exceeded_total", "Webhook requests acknowledged before the bot finished, because it exceeded blocking_budget.", ("route",))
+OUTBOX_EXPIRED = REGISTRY.counter("cvg_outbox_expired_total", "Commands given up by the outbox, because they could not be delivered before they expired.")
+OUTBOUND_SUPERSEDED = REGISTRY.counter("cvg_outbound_superseded_total", "Say commands cancelled because a newer message of their dialog arrived before they were sent.")
+BUSY_MESSAGES_REPLACED = REGISTRY.counter("cvg_busy_messages_replaced_total", "Pending messages of a busy dialog replaced by a newer message before they were processed.")
@@ -0,0 +1,305 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Collection, Deque, Dict, List, Optional, Set, Text, Tuple
+
+from rasa_vier_cvg import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxCommand:
+    """A command for CVG, with everything needed to send it again after a restart"""
+
+    __slots__ = ("id", "dialog_id", "callback", "auth_token", "method", "path", "data", "expires_at")
+
+    id: Text
+    dialog_id: Text
+    callback: Text
+    auth_token: Text
+    method: Text
+    path: Text
+    data: Any
+    # Wall clock time, so it is still valid after a restart
+    expires_at: float
+
+    def __init__(self, id: Text, dialog_id: Text, callback: Text, auth_token: Text, method: Text, path: Text, data: Any, expires_at: float) -> None:
+        self.id = id
+        self.dialog_id = dialog_id
+        self.callback = callback
+        self.auth_token = auth_token
+        self.method = method
+        self.path = path
+        self.data = data
+        self.expires_at = expires_at
+
+    @classmethod
+    def create(cls, dialog_id: Text, callback: Text, auth_token: Text, method: Text, path: Text, data: Any, ttl: float) -> "OutboxCommand":
+        return cls(uuid.uuid4().hex, dialog_id, callback, auth_token, method, path, data, time.time() + ttl)
+
+
+class OutboxStore(ABC):
+    """Persists the commands of the outbox, so they survive a restart"""
+
+    @abstractmethod
+    async def write(self, added: List[OutboxCommand], removed: List[Text]) -> None:
+        """Adds and removes the given commands in a single batch."""
+
+    @abstractmethod
+    async def load(self) -> List[OutboxCommand]:
+        """Returns the commands that have not expired yet, in the order they were added."""
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemoryOutboxStore(OutboxStore):
+    """Keeps the commands only in the memory of the outbox, so they survive network failures but not restarts"""
+
+    async def write(self, added: List[OutboxCommand], removed: List[Text]) -> None:
+        pass
+
+    async def load(self) -> List[OutboxCommand]:
+        return []
+
+
+class SqliteOutboxStore(OutboxStore):
+    """Keeps the commands in a SQLite file, every Sanic worker and Rasa instance needs its own file"""
+
+    path: Text
+
+    def __init__(self, path: Text) -> None:
+        self.path = path
+        # All statements run on a single thread, so the batches are written in order and the event loop never blocks on the disk
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cvg-outbox")
+        self.connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS outbox (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, dialog_id TEXT NOT NULL, callback TEXT NOT NULL, auth_token TEXT NOT NULL, method TEXT NOT NULL, path TEXT NOT NULL, data TEXT, expires_at REAL NOT NULL)")
+            self.connection = connection
+        return self.connection
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _write(self, added: List[OutboxCommand], removed: List[Text]):
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT OR IGNORE INTO outbox (id, dialog_id, callback, auth_token, method, path, data, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(c.id, c.dialog_id, c.callback, c.auth_token, c.method, c.path, json.dumps(c.data), c.expires_at) for c in added],
+            )
+            connection.executemany("DELETE FROM outbox WHERE id = ?", [(command_id,) for command_id in removed])
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _load(self) -> List[OutboxCommand]:
+        connection = self._connect()
+        connection.execute("DELETE FROM outbox WHERE expires_at <= ?", (time.time(),))
+        rows = connection.execute("SELECT id, dialog_id, callback, auth_token, method, path, data, expires_at FROM outbox ORDER BY seq").fetchall()
+        return [OutboxCommand(id, dialog_id, callback, auth_token, method, path, json.loads(data), expires_at) for id, dialog_id, callback, auth_token, method, path, data, expires_at in rows]
+
+    def _close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    async def write(self, added: List[OutboxCommand], removed: List[Text]) -> None:
+        await self._run(self._write, added, removed)
+
+    async def load(self) -> List[OutboxCommand]:
+        return await self._run(self._load)
+
+    async def close(self) -> None:
+        await self._run(self._close)
+        self.executor.shutdown(wait=False)
+
+
+class Outbox:
+    """Delivers commands that must not get lost, retrying each of them until it has been delivered or expired.
+
+    New commands are written to the store in batches, while they are sent for the first time. A command is only
+    sent again once its batch has been written. If a batch cannot be written, its commands are still delivered,
+    they just do not survive a restart.
+    The commands added by this process are sent by the caller, so they keep their place among its other commands.
+    The commands left over from an earlier process are delivered one after another per dialog, in the order they were added.
+    Delivering a command that has been removed from the store shortly before a crash is repeated after the restart.
+    """
+
+    store: OutboxStore
+    ttl: float
+    batch_size: int
+    flush_interval: float
+    retry_interval: float
+    retry_max_interval: float
+    retryable_status_codes: Collection[int]
+    # The commands left over from an earlier process, per dialog
+    queues: Dict[Text, Deque[OutboxCommand]]
+    # The commands added by this process that have not been delivered or expired yet, by id
+    sending: Dict[Text, OutboxCommand]
+
+    def __init__(self, store: OutboxStore, ttl: float, retryable_status_codes: Collection[int], batch_size: int = 100, flush_interval: float = 0.05, retry_interval: float = 1.0, retry_max_interval: float = 30.0, clock: Callable[[], float] = time.time) -> None:
+        self.store = store
+        self.ttl = ttl
+        self.retryable_status_codes = retryable_status_codes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.retry_max_interval = retry_max_interval
+        self.clock = clock
+        self.queues = {}
+        self.sending = {}
+        self.drains: Dict[Text, asyncio.Task] = {}
+        self.added: List[OutboxCommand] = []
+        self.removed: List[Text] = []
+        # Resolves once the batch of the added commands has been written
+        self.batch_written: Optional[asyncio.Future] = None
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.writes: Set[asyncio.Task] = set()
+        self.deliver: Optional[Callable[[OutboxCommand], Awaitable[Tuple[int, Any]]]] = None
+
+    @property
+    def backlog(self) -> int:
+        return len(self.sending) + sum(len(queue) for queue in self.queues.values())
+
+    async def start(self, deliver: Callable[[OutboxCommand], Awaitable[Tuple[int, Any]]]):
+        """Delivers the commands left over from an earlier process with the given function"""
+        self.deliver = deliver
+        commands = await self.store.load()
+        if commands:
+            logger.info(f"Delivering {len(commands)} commands left in the outbox")
+        for command in commands:
+            self.queues.setdefault(command.dialog_id, deque()).append(command)
+        for dialog_id in list(self.queues):
+            self._start_drain(dialog_id)
+
+    # Adding does not wait for the batch to be written, so a turn sending several commands is not delayed by the flush interval
+    def add(self, command: OutboxCommand) -> "asyncio.Future[None]":
+        """Adds the command to the next batch, it must then be sent with send(), the returned future resolves once it has been stored."""
+        self.sending[command.id] = command
+        self.added.append(command)
+        if self.batch_written is None:
+            self.batch_written = asyncio.get_running_loop().create_future()
+        written = self.batch_written
+        self._schedule_flush(len(self.added) >= self.batch_size)
+        return written
+
+    async def send(self, command: OutboxCommand, written: "asyncio.Future[None]", send: Callable[[OutboxCommand], Awaitable[Tuple[int, Any]]]) -> Tuple[int, Any]:
+        """Sends an added command until it has been delivered or expired, then removes it from the store"""
+        status, body = await self._deliver_until_expired(command, send, written)
+        self.sending.pop(command.id, None)
+        self._remove(command.id)
+        return status, body
+
+    def _remove(self, command_id: Text):
+        self.removed.append(command_id)
+        self._schedule_flush(len(self.removed) >= self.batch_size)
+
+    def _schedule_flush(self, now: bool):
+        if now:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self._flush)
+
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.added and not self.removed:
+            return
+        added, self.added = self.added, []
+        removed, self.removed = self.removed, []
+        written, self.batch_written = self.batch_written, None
+        task = asyncio.ensure_future(self._write(added, removed, written))
+        self.writes.add(task)
+        task.add_done_callback(self.writes.discard)
+
+    async def _write(self, added: List[OutboxCommand], removed: List[Text], written: Optional[asyncio.Future]):
+        try:
+            await self.store.write(added, removed)
+        except Exception as e:
+            logger.error("Failed to write %s new and %s delivered commands to the outbox, delivering them anyway: %s", len(added), len(removed), e, exc_info=True)
+        if written is not None and not written.done():
+            written.set_result(None)
+
+    def _start_drain(self, dialog_id: Text):
+        if self.deliver is not None and dialog_id not in self.drains:
+            self.drains[dialog_id] = asyncio.ensure_future(self._drain(dialog_id, self.queues[dialog_id]))
+
+    async def _drain(self, dialog_id: Text, queue: Deque[OutboxCommand]):
+        try:
+            while queue:
+                command = queue[0]
+                status, body = await self._deliver_until_expired(command, self.deliver)
+                queue.popleft()
+                self._remove(command.id)
+                # Nobody waits for these commands, their turn is gone
+                if not 200 <= status < 300:
+                    logger.error("%s - Failed to deliver %s %s from the outbox: status=%s", command.dialog_id, command.method, command.path, status, extra={"dialog_id": command.dialog_id, "status": status})
+        finally:
+            if not queue:
+                del self.queues[dialog_id]
+            del self.drains[dialog_id]
+
+    async def _deliver_until_expired(self, command: OutboxCommand, send: Callable[[OutboxCommand], Awaitable[Tuple[int, Any]]], written: Optional[asyncio.Future] = None) -> Tuple[int, Any]:
+        attempt = 0
+        while True:
+            try:
+                status, body = await send(command)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("%s - Failed to deliver %s %s from the outbox: %s", command.dialog_id, command.method, command.path, e, exc_info=True, extra={"dialog_id": command.dialog_id})
+                status, body = -1, None
+            if status not in self.retryable_status_codes:
+                return status, body
+
+            delay = min(self.retry_interval * 2 ** attempt, self.retry_max_interval)
+            attempt += 1
+            if self.clock() + delay >= command.expires_at:
+                logger.error("%s - Giving up on %s %s from the outbox after %s attempts, it expired", command.dialog_id, command.method, command.path, attempt, extra={"dialog_id": command.dialog_id, "status": status})
+                metrics.OUTBOX_EXPIRED.inc()
+                return status, body
+            logger.warning("%s - Delivering %s %s from the outbox failed (status=%s), retrying in %.3fs...", command.dialog_id, command.method, command.path, status, delay, extra={"dialog_id": command.dialog_id, "status": status})
+            # The command must have been stored before it is retried, so the retries survive a restart
+            if written is not None:
+                await asyncio.shield(written)
+            await asyncio.sleep(delay)
+
+    async def close(self):
+        drains = list(self.drains.values())
+        for drain in drains:
+            drain.cancel()
+        await asyncio.gather(*drains, return_exceptions=True)
+        self._flush()
+        if self.writes:
+            await asyncio.gather(*self.writes, return_exceptions=True)
+        backlog = self.backlog
+        if backlog > 0:
+            logger.warning(f"Stopping with {backlog} undelivered commands in the outbox")
+        await self.store.close()
+
+
+def create_outbox(kind: Text, path: Optional[Text], ttl: float, retryable_status_codes: Collection[int], batch_size: int, flush_interval: float, retry_interval: float, retry_max_interval: float) -> Optional[Outbox]:
+    if kind == "none":
+        return None
+    if kind == "memory":
+        # Nothing is written, so there is no point in waiting for a batch
+        return Outbox(InMemoryOutboxStore(), ttl, retryable_status_codes, 1, 0.0, retry_interval, retry_max_interval)
+    if kind == "sqlite":
+        if not path:
+            raise ValueError('The sqlite outbox requires outbox_path in your credentials.yml!')
+        return Outbox(SqliteOutboxStore(path), ttl, retryable_status_codes, batch_size, flush_interval, retry_interval, retry_max_interval)
+    raise ValueError(f'Unknown outbox {kind}, use one of: none, memory, sqlite')
@@ -0,0 +1,130 @@
+import json
+from typing import Any, Dict, Text
+
+try:
+    import orjson
+
+    JSON_DECODER = "orjson"
+
+    def loads(data: bytes) -> Any:
+        return orjson.loads(data)
+except ImportError:
+    JSON_DECODER = "json"
+
+    def loads(data: bytes) -> Any:
+        return json.loads(data)
+
+DIALOG_ID_FIELD = "dialogId"
+PROJECT_CONTEXT_FIELD = "projectContext"
+RESELLER_TOKEN_FIELD = "resellerToken"
+PROJECT_TOKEN_FIELD = "projectToken"
+CALLBACK_FIELD = "callback"
+AUTH_TOKEN_FIELD = "authToken"
+TEXT_FIELD = "text"
+TYPE_FIELD = "type"
+NAME_FIELD = "name"
+TIMESTAMP_FIELD = "timestamp"
+
+
+class InvalidPayload(ValueError):
+    """Raised when a webhook body is not valid JSON or misses a required field"""
+
+
+def _require_text(body: Dict[Text, Any], field: Text, context: Text = "") -> Text:
+    value = body.get(field)
+    if value is None:
+        raise InvalidPayload(f"{field} is required{context}")
+    if not isinstance(value, str):
+        raise InvalidPayload(f"{field} must be a string{context}")
+    return value
+
+
+class WebhookRequest:
+    """The validated body of a webhook request from CVG.
+
+    The fields used by the channel are extracted once, the full body is kept as the metadata of the user message.
+    """
+
+    __slots__ = ("body", "dialog_id", "callback", "auth_token", "reseller_token", "project_token")
+
+    # The name of the webhook route delivering this payload
+    ROUTE = ""
+
+    body: Dict[Text, Any]
+    dialog_id: Text
+    callback: Text
+    auth_token: Text
+    reseller_token: Text
+    project_token: Text
+
+    def __init__(self, body: Any) -> None:
+        if not isinstance(body, dict):
+            raise InvalidPayload("body must be a JSON object")
+        self.body = body
+        self.dialog_id = _require_text(body, DIALOG_ID_FIELD)
+        self.callback = _require_text(body, CALLBACK_FIELD)
+        self.auth_token = _require_text(body, AUTH_TOKEN_FIELD)
+        project_context = body.get(PROJECT_CONTEXT_FIELD)
+        if not isinstance(project_context, dict):
+            raise InvalidPayload(f"{PROJECT_CONTEXT_FIELD} is required")
+        self.reseller_token = _require_text(project_context, RESELLER_TOKEN_FIELD, f" in {PROJECT_CONTEXT_FIELD}")
+        self.project_token = _require_text(project_context, PROJECT_TOKEN_FIELD, f" in {PROJECT_CONTEXT_FIELD}")
+
+    @classmethod
+    def parse(cls, raw: bytes):
+        try:
+            body = loads(raw)
+        except ValueError:
+            raise InvalidPayload("body is not valid json.")
+        return cls(body)
+
+
+class SessionRequest(WebhookRequest):
+    __slots__ = ()
+
+    ROUTE = "session"
+
+
+class MessageRequest(WebhookRequest):
+    __slots__ = ("text",)
+
+    ROUTE = "message"
+
+    text: Text
+
+    def __init__(self, body: Any) -> None:
+        super().__init__(body)
+        self.text = _require_text(body, TEXT_FIELD)
+
+
+class AnswerRequest(WebhookRequest):
+    __slots__ = ("answer_type",)
+
+    ROUTE = "answer"
+
+    answer_type: Text
+
+    def __init__(self, body: Any) -> None:
+        super().__init__(body)
+        answer_type = body.get(TYPE_FIELD)
+        if not isinstance(answer_type, dict):
+            raise InvalidPayload(f"{TYPE_FIELD} is required")
+        self.answer_type = _require_text(answer_type, NAME_FIELD, f" in {TYPE_FIELD}")
+
+
+class InactivityRequest(WebhookRequest):
+    __slots__ = ()
+
+    ROUTE = "inactivity"
+
+
+class TerminatedRequest(WebhookRequest):
+    __slots__ = ()
+
+    ROUTE = "terminated"
+
+
+class RecordingRequest(WebhookRequest):
+    __slots__ = ()
+
+    ROUTE = "recording"
@@ -24,6 +24,10 @@ setup(
         'aiodns',
         'asyncio',
     ],
+    extras_require={
+        'redis': ['redis>=4.2'],
+        'orjson': ['orjson'],
+    },
     packages=find_packages(),
     include_package_data=True,
     license="MIT",
@@ -0,0 +1,54 @@
+import asyncio
+import socket
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+from aiohttp import web
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class CVGStub:
+    """A local stand-in for CVG's callback API, answering every path with the responses scripted for it (204 by default)"""
+
+    def __init__(self) -> None:
+        self.requests: List[Tuple[Text, Text, Any]] = []
+        self.responses: Dict[Text, List[Tuple[int, Any, float]]] = {}
+        self.runner: Optional[web.AppRunner] = None
+        self.port = free_port()
+
+    @property
+    def url(self) -> Text:
+        return f"http://127.0.0.1:{self.port}"
+
+    def script(self, path: Text, *responses: Tuple[int, Any, float]):
+        """Each response is a tuple of status, body and the seconds to wait before answering"""
+        self.responses.setdefault(path, []).extend(responses)
+
+    def paths(self) -> List[Text]:
+        return [path for _, path, _ in self.requests]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.json() if request.can_read_body else None
+        self.requests.append((request.method, request.path, body))
+        scripted = self.responses.get(request.path)
+        status, response_body, delay = scripted.pop(0) if scripted else (204, None, 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if status == 204:
+            return web.Response(status=204)
+        return web.json_response(response_body, status=status)
+
+    async def __aenter__(self) -> "CVGStub":
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", self.port).start()
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.runner.cleanup()
@@ -0,0 +1,92 @@
+import time
+from typing import Any, Dict, Optional, Text, Tuple
+
+from rasa_vier_cvg.busy import RedisBusyDialogStore
+
+
+class FakeRedis:
+    """An in-process replacement of the redis.asyncio client, implementing the commands used by RedisBusyDialogStore.
+
+    Several stores sharing one instance behave like replicas sharing one Redis server.
+    """
+
+    def __init__(self) -> None:
+        self.values: Dict[Text, Tuple[Any, Optional[float]]] = {}
+        self.sorted_sets: Dict[Text, Dict[Text, float]] = {}
+        self.fail = False
+
+    def _check(self):
+        if self.fail:
+            raise ConnectionError("fake redis is down")
+
+    def _get(self, key: Text) -> Any:
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+    async def set(self, key: Text, value: Any, nx: bool = False, px: Optional[int] = None) -> Optional[bool]:
+        self._check()
+        if nx and self._get(key) is not None:
+            return None
+        self.values[key] = (value, None if px is None else time.monotonic() + px / 1000)
+        return True
+
+    async def get(self, key: Text) -> Any:
+        self._check()
+        return self._get(key)
+
+    async def eval(self, script: Text, numkeys: int, *args: Any) -> Any:
+        """Runs the scripts of RedisBusyDialogStore, which are atomic like on a real server"""
+        self._check()
+        key, leases_key = args[:numkeys]
+        if script == RedisBusyDialogStore.ACQUIRE_SCRIPT:
+            token, px, score, member = args[numkeys:]
+            if self._get(key) is not None:
+                return 0
+            self.values[key] = (token, time.monotonic() + px / 1000)
+            self.sorted_sets.setdefault(leases_key, {})[member] = score
+            return 1
+        if script == RedisBusyDialogStore.RENEW_SCRIPT:
+            token, px, score, member = args[numkeys:]
+            if self._get(key) != token:
+                return 0
+            self.values[key] = (token, time.monotonic() + px / 1000)
+            self.sorted_sets.setdefault(leases_key, {})[member] = score
+            return 1
+        assert script == RedisBusyDialogStore.RELEASE_SCRIPT
+        token, member = args[numkeys:]
+        if self._get(key) != token:
+            return 0
+        self.sorted_sets.get(leases_key, {}).pop(member, None)
+        del self.values[key]
+        return 1
+
+    async def zadd(self, key: Text, mapping: Dict[Text, float]) -> int:
+        self._check()
+        self.sorted_sets.setdefault(key, {}).update(mapping)
+        return len(mapping)
+
+    async def zrem(self, key: Text, *members: Text) -> int:
+        self._check()
+        members_of_key = self.sorted_sets.get(key, {})
+        return sum(1 for member in members if members_of_key.pop(member, None) is not None)
+
+    async def zremrangebyscore(self, key: Text, minimum: Any, maximum: float) -> int:
+        self._check()
+        members = self.sorted_sets.get(key, {})
+        expired = [member for member, score in members.items() if score <= maximum]
+        for member in expired:
+            del members[member]
+        return len(expired)
+
+    async def zcard(self, key: Text) -> int:
+        self._check()
+        return len(self.sorted_sets.get(key, {}))
+
+    async def close(self) -> None:
+        pass
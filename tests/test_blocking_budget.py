@@ -0,0 +1,38 @@
+import asyncio
+import time
+
+from rasa_vier_cvg import metrics
+from rasa_vier_cvg.cvg import CVGInput
+from tests.cvg_stub import CVGStub
+from tests.webhook_server import serve_webhook
+
+TOKEN = "token"
+
+
+def test_a_request_is_answered_after_the_budget_while_the_turn_finishes_in_the_background():
+    async def scenario():
+        async with CVGStub() as stub:
+            async def on_new_message(message):
+                await asyncio.sleep(0.3)
+                await message.output_channel.send_text_message(message.sender_id, "done", None)
+
+            channel = CVGInput(TOKEN, "/cvg_session", None, True, True, "off", blocking_budget=0.05)
+            exceeded = metrics.BLOCKING_BUDGET_EXCEEDED.get("message")
+            async with serve_webhook(channel, TOKEN, on_new_message) as client:
+                start = time.perf_counter()
+                status, _, _ = await client.post("message", {
+                    "dialogId": "09e59647-5c77-4c02-a1c5-7fb2b47060f1",
+                    "callback": stub.url,
+                    "authToken": "auth-token",
+                    "projectContext": {"resellerToken": "reseller", "projectToken": "project"},
+                    "text": "hello",
+                })
+                assert status == 204
+                assert time.perf_counter() - start < 0.25
+                assert stub.paths() == []
+                assert metrics.BLOCKING_BUDGET_EXCEEDED.get("message") == exceeded + 1
+
+                await asyncio.sleep(0.4)
+                assert [body["text"] for _, path, body in stub.requests if path == "/call/say"] == ["done"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,243 @@
+import asyncio
+
+import pytest
+
+from rasa_vier_cvg.busy import InMemoryBusyDialogStore, RedisBusyDialogStore, SqliteBusyDialogStore, create_busy_dialog_store
+from rasa_vier_cvg.cvg import CVGInput, parse_busy_mode
+from rasa_vier_cvg.payloads import MessageRequest
+from tests.fake_redis import FakeRedis
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def shared_stores(kind, tmp_path, ttl=60.0):
+    """Returns two stores sharing their state, like two replicas of the channel"""
+    if kind == "memory":
+        store = InMemoryBusyDialogStore(ttl)
+        return store, store
+    if kind == "sqlite":
+        path = str(tmp_path / "busy.db")
+        return SqliteBusyDialogStore(ttl, path), SqliteBusyDialogStore(ttl, path)
+    client = FakeRedis()
+    return RedisBusyDialogStore(ttl, "redis://fake", client), RedisBusyDialogStore(ttl, "redis://fake", client)
+
+
+STORES = ["memory", "sqlite", "redis"]
+
+
+@pytest.mark.parametrize("kind", STORES)
+def test_a_busy_dialog_cannot_be_acquired_by_another_replica(kind, tmp_path):
+    async def scenario():
+        first, second = shared_stores(kind, tmp_path)
+        lease = await first.acquire("dialog")
+        assert lease is not None
+        assert await second.acquire("dialog") is None
+        assert await second.acquire("other dialog") is not None
+        assert await first.count() == 2
+
+        await first.release("dialog", lease)
+        assert await second.acquire("dialog") is not None
+        await first.close()
+        await second.close()
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("kind", STORES)
+def test_an_expired_lease_can_be_acquired_again_and_is_not_released_by_its_old_owner(kind, tmp_path):
+    async def scenario():
+        first, second = shared_stores(kind, tmp_path, ttl=0.05)
+        old_lease = await first.acquire("dialog")
+        await asyncio.sleep(0.1)
+        assert await first.count() == 0
+        new_lease = await second.acquire("dialog")
+        assert new_lease is not None
+
+        await first.release("dialog", old_lease)
+        assert await first.acquire("dialog") is None
+        await second.release("dialog", new_lease)
+        assert await first.count() == 0
+        await first.close()
+        await second.close()
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("kind", STORES)
+def test_a_renewed_lease_outlives_its_ttl_and_an_expired_one_cannot_be_renewed_once_taken(kind, tmp_path):
+    async def scenario():
+        first, second = shared_stores(kind, tmp_path, ttl=0.2)
+        lease = await first.acquire("dialog")
+        await asyncio.sleep(0.15)
+        assert await first.renew("dialog", lease)
+        await asyncio.sleep(0.15)
+        assert await second.acquire("dialog") is None
+        assert await second.count() == 1
+
+        await asyncio.sleep(0.1)
+        assert await second.acquire("dialog") is not None
+        assert not await first.renew("dialog", lease)
+        await first.close()
+        await second.close()
+
+    run(scenario())
+
+
+def test_create_busy_dialog_store_requires_the_location_of_shared_stores():
+    with pytest.raises(ValueError):
+        create_busy_dialog_store("sqlite", 60.0, None, None)
+    with pytest.raises(ValueError):
+        create_busy_dialog_store("redis", 60.0, None, None)
+    with pytest.raises(ValueError):
+        create_busy_dialog_store("unknown", 60.0, None, None)
+
+
+def test_messages_are_processed_while_the_busy_dialog_store_is_unavailable():
+    async def scenario():
+        client = FakeRedis()
+        client.fail = True
+        channel = CVGInput("token", "/cvg_session", None, True, True, "drop", busy_dialogs=RedisBusyDialogStore(60.0, "redis://fake", client))
+        received = []
+
+        async def on_new_message(message):
+            received.append(message.text)
+
+        payload = MessageRequest({
+            "dialogId": "dialog",
+            "callback": "http://127.0.0.1:1",
+            "authToken": "auth-token",
+            "projectContext": {"resellerToken": "reseller", "projectToken": "project"},
+            "text": "hello",
+        })
+        session = channel._get_session(payload, on_new_message)
+        await channel._process_message(payload, session, on_new_message, payload.text)
+        assert received == ["hello"]
+
+    run(scenario())
+
+
+def create_message(text):
+    return MessageRequest({
+        "dialogId": "dialog",
+        "callback": "http://127.0.0.1:1",
+        "authToken": "auth-token",
+        "projectContext": {"resellerToken": "reseller", "projectToken": "project"},
+        "text": text,
+    })
+
+
+def test_busy_mode_accepts_the_modes_and_booleans():
+    assert [parse_busy_mode(value) for value in [None, False, True, "off", "Drop", "latest"]] == ["off", "off", "drop", "off", "drop", "latest"]
+    with pytest.raises(ValueError):
+        parse_busy_mode("newest")
+
+
+def test_the_latest_message_is_processed_after_the_current_turn_without_delaying_its_request():
+    async def scenario():
+        busy_dialogs = InMemoryBusyDialogStore(60.0)
+        channel = CVGInput("token", "/cvg_session", None, True, True, "latest", busy_dialogs=busy_dialogs)
+        first_turn_done = asyncio.Event()
+        follow_up_started = asyncio.Event()
+        follow_up_done = asyncio.Event()
+        received = []
+
+        async def on_new_message(message):
+            received.append(message.text)
+            if message.text == "first":
+                await first_turn_done.wait()
+            else:
+                follow_up_started.set()
+                await follow_up_done.wait()
+
+        async def process(text):
+            payload = create_message(text)
+            session = channel._get_session(payload, on_new_message)
+            await channel._process_message(payload, session, on_new_message, payload.text)
+
+        first = asyncio.ensure_future(process("first"))
+        await asyncio.sleep(0)
+        await process("second")
+        await process("third")
+        first_turn_done.set()
+        # The request of the first message is answered while the follow-up turn is still running
+        await first
+        await follow_up_started.wait()
+        assert received == ["first", "third"]
+        assert await busy_dialogs.count() == 1
+
+        follow_up_done.set()
+        await channel.task_container.drain(1.0)
+        assert await busy_dialogs.count() == 0
+        assert channel.pending_messages == {}
+
+    run(scenario())
+
+
+class SlowReleaseBusyDialogStore(InMemoryBusyDialogStore):
+    async def release(self, dialog_id, token):
+        await asyncio.sleep(0.05)
+        await super().release(dialog_id, token)
+
+
+class FlakyBusyDialogStore(InMemoryBusyDialogStore):
+    def __init__(self, ttl, failing_calls):
+        super().__init__(ttl)
+        self.calls = 0
+        self.failing_calls = failing_calls
+
+    async def acquire(self, dialog_id):
+        self.calls += 1
+        if self.calls in self.failing_calls:
+            raise ConnectionError("store is down")
+        return await super().acquire(dialog_id)
+
+
+def create_channel(busy_dialogs):
+    channel = CVGInput("token", "/cvg_session", None, True, True, "latest", busy_dialogs=busy_dialogs)
+    received = []
+
+    async def on_new_message(message):
+        received.append(message.text)
+        await asyncio.sleep(0.02)
+
+    async def process(text):
+        payload = create_message(text)
+        session = channel._get_session(payload, on_new_message)
+        await channel._process_message(payload, session, on_new_message, payload.text)
+
+    return channel, received, process
+
+
+def test_a_message_arriving_while_the_lease_is_released_is_processed():
+    async def scenario():
+        busy_dialogs = SlowReleaseBusyDialogStore(60.0)
+        channel, received, process = create_channel(busy_dialogs)
+        first = asyncio.ensure_future(process("first"))
+        # The first turn takes 20ms, its release another 50ms
+        await asyncio.sleep(0.04)
+        await process("second")
+        await first
+        await channel.task_container.drain(1.0)
+        assert received == ["first", "second"]
+        assert await busy_dialogs.count() == 0
+        assert channel.pending_messages == {}
+
+    run(scenario())
+
+
+def test_a_message_processed_without_a_lease_keeps_the_pending_message_of_another_turn():
+    async def scenario():
+        busy_dialogs = FlakyBusyDialogStore(60.0, {3})
+        channel, received, process = create_channel(busy_dialogs)
+        first = asyncio.ensure_future(process("first"))
+        await asyncio.sleep(0)
+        await process("second")
+        await process("third")
+        await first
+        await channel.task_container.drain(1.0)
+        assert received == ["first", "third", "second"]
+        assert await busy_dialogs.count() == 0
+
+    run(scenario())
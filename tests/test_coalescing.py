@@ -0,0 +1,34 @@
+import asyncio
+
+from rasa_vier_cvg.cvg import CVGInput
+from rasa_vier_cvg.payloads import MessageRequest
+from tests.cvg_stub import CVGStub
+from tests.test_turns import create_body, process
+
+
+def test_texts_are_merged_until_a_command_or_the_end_of_the_turn():
+    async def run():
+        async with CVGStub() as stub:
+            channel = CVGInput("token", "/cvg_session", None, True, True, "off", say_separator=" | ")
+            buffered = []
+
+            async def on_new_message(message):
+                output = message.output_channel
+                await output.send_text_message(message.sender_id, "one", None)
+                await output.send_text_message(message.sender_id, "two", None)
+                buffered.append(list(stub.paths()))
+                await output.send_custom_json(message.sender_id, {"cvg_call_play": {"url": "https://example.com/music.wav"}})
+                await output.send_text_message(message.sender_id, "three", None)
+                await output.send_text_message(message.sender_id, "four", None)
+
+            await process(channel, MessageRequest(create_body(stub, text="hi")), on_new_message, "hi")
+            await channel.task_container.drain(5.0)
+            await channel.session_pool.close()
+            assert buffered == [[]]
+            assert [(path, body.get("text")) for _, path, body in stub.requests] == [
+                ("/call/say", "one | two"),
+                ("/call/play", None),
+                ("/call/say", "three | four"),
+            ]
+
+    asyncio.run(run())
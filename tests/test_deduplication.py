@@ -0,0 +1,47 @@
+from rasa_vier_cvg.cvg import DialogSession, DialogSessionRegistry
+
+DIALOG_ID = "09e59647-5c77-4c02-a1c5-7fb2b47060f1"
+FINGERPRINT = ("terminated", 1700000000000, "/cvg_terminated")
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def create_session() -> DialogSession:
+    return DialogSession(DIALOG_ID, DIALOG_ID, "http://localhost", "auth-token", None)
+
+
+def test_a_forgotten_request_is_not_a_duplicate():
+    session = create_session()
+    assert not session.is_duplicate(FINGERPRINT, 60.0, 32, 0.0)
+    session.forget(FINGERPRINT)
+    assert not session.is_duplicate(FINGERPRINT, 60.0, 32, 1.0)
+    assert session.is_duplicate(FINGERPRINT, 60.0, 32, 2.0)
+
+
+def test_requests_of_a_removed_dialog_are_recognized_until_the_window_expires():
+    clock = FakeClock()
+    registry = DialogSessionRegistry(clock=clock)
+    session = create_session()
+    registry.add(session)
+    assert not session.is_duplicate(FINGERPRINT, 60.0, 32, clock.now)
+    registry.remove(DIALOG_ID, 60.0)
+
+    clock.now = 30.0
+    assert registry.get(DIALOG_ID) is None
+    redelivered = create_session()
+    registry.add(redelivered)
+    assert redelivered.is_duplicate(FINGERPRINT, 60.0, 32, clock.now)
+    registry.remove(DIALOG_ID, 60.0)
+
+    clock.now = 100.0
+    assert registry.get(DIALOG_ID) is None
+    assert not registry.removed
+    late = create_session()
+    registry.add(late)
+    assert not late.is_duplicate(FINGERPRINT, 60.0, 32, clock.now)
@@ -0,0 +1,16 @@
+import pytest
+
+from rasa_vier_cvg.metadata import MetadataProjections
+
+
+def test_allow_and_deny_lists_select_the_fields():
+    projections = MetadataProjections.parse({"message": {"allow": ["dialogId", "text"]}, "default": {"deny": ["customSipHeaders"]}}, False)
+    payload = {"dialogId": "dialog", "text": "Hi", "customSipHeaders": {}, "language": "de-DE"}
+    assert projections.apply("message", payload) == {"dialogId": "dialog", "text": "Hi"}
+    assert projections.apply("session", payload) == {"dialogId": "dialog", "text": "Hi", "language": "de-DE"}
+
+
+@pytest.mark.parametrize("fields", [{"allow": "dialogId"}, {"deny": "customSipHeaders"}, {"allow": [["dialogId"]]}])
+def test_fields_that_are_not_a_list_are_rejected(fields):
+    with pytest.raises(ValueError):
+        MetadataProjections.parse({"message": fields}, False)
@@ -0,0 +1,26 @@
+import asyncio
+
+from rasa_vier_cvg.busy import RedisBusyDialogStore
+from rasa_vier_cvg.metrics import MetricsRegistry
+from tests.fake_redis import FakeRedis
+
+
+def test_a_gauge_that_cannot_be_read_is_left_out_and_counted():
+    async def scenario():
+        client = FakeRedis()
+        client.fail = True
+        registry = MetricsRegistry()
+        registry.gauge("cvg_busy_dialogs", "Dialogs with a message being processed.", RedisBusyDialogStore(60.0, "redis://fake", client).count)
+        registry.gauge("cvg_dialog_sessions", "Active dialogs held by the session registry.", lambda: 3)
+
+        text = await registry.render()
+        assert not [line for line in text.splitlines() if line.startswith("cvg_busy_dialogs")]
+        assert "cvg_dialog_sessions 3\n" in text
+        assert 'cvg_metrics_scrape_errors_total{metric="cvg_busy_dialogs"} 1\n' in text
+
+        client.fail = False
+        text = await registry.render()
+        assert "cvg_busy_dialogs 0\n" in text
+        assert 'cvg_metrics_scrape_errors_total{metric="cvg_busy_dialogs"} 1\n' in text
+
+    asyncio.run(scenario())
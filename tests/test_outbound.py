@@ -0,0 +1,236 @@
+import asyncio
+
+from rasa_vier_cvg import metrics
+from rasa_vier_cvg.cvg import (
+    CircuitBreaker,
+    CircuitBreakerRegistry,
+    ClientSessionPool,
+    CVGOutput,
+    DialogCommandQueue,
+    NO_RESPONSE,
+    NOT_SENT,
+    OUTBOX_RETRYABLE_STATUS_CODES,
+    RetryPolicy,
+    TaskContainer,
+    create_recipient_id,
+)
+from rasa_vier_cvg.outbox import create_outbox
+from tests.cvg_stub import CVGStub
+
+DIALOG_ID = "09e59647-5c77-4c02-a1c5-7fb2b47060f1"
+
+
+async def ignore_message(message):
+    pass
+
+
+def create_output(stub: CVGStub, retry_policy: RetryPolicy, circuit_breakers: CircuitBreakerRegistry, outbox=None) -> CVGOutput:
+    return CVGOutput(stub.url, "auth-token", ignore_message, None, TaskContainer(), True, ClientSessionPool(), DialogCommandQueue(), retry_policy, circuit_breakers, outbox=outbox)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_backoff_grows_exponentially_up_to_the_maximum():
+    policy = RetryPolicy(backoff_base=0.1, backoff_max=1.0, jitter=0.0)
+    assert [policy.backoff(attempt) for attempt in range(6)] == [0.1, 0.2, 0.4, 0.8, 1.0, 1.0]
+
+
+def test_backoff_jitter_only_shortens_the_delay():
+    policy = RetryPolicy(backoff_base=0.1, backoff_max=1.0, jitter=0.5)
+    for _ in range(100):
+        assert 0.1 <= policy.backoff(1) <= 0.2
+
+
+def test_circuit_breaker_opens_and_recovers_after_a_successful_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker("cvg", failure_threshold=2, reset_timeout=30.0, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.now = 30.0
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only a single probe is let through
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_circuit_breaker_reopens_after_a_failed_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker("cvg", failure_threshold=1, reset_timeout=30.0, clock=clock)
+    breaker.record_failure()
+    clock.now = 30.0
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_gateway_errors_are_retried():
+    async def run():
+        async with CVGStub() as stub:
+            stub.script("/call/say", (503, {}, 0.0), (502, {}, 0.0))
+            output = create_output(stub, RetryPolicy(max_retries=3, backoff_base=0.01), CircuitBreakerRegistry())
+            retries = metrics.OUTBOUND_RETRIES.get("call_say")
+            status, _ = await output._perform_request_sync("/call/say", "POST", {"dialogId": DIALOG_ID, "text": "Hi"}, DIALOG_ID)
+            await output.session_pool.close()
+            assert status == 204
+            assert stub.paths() == ["/call/say"] * 3
+            assert metrics.OUTBOUND_RETRIES.get("call_say") == retries + 2
+
+    asyncio.run(run())
+
+
+def test_retries_stop_after_max_retries():
+    async def run():
+        async with CVGStub() as stub:
+            stub.script("/call/say", *[(503, {}, 0.0)] * 5)
+            output = create_output(stub, RetryPolicy(max_retries=2, backoff_base=0.01), CircuitBreakerRegistry(failure_threshold=0))
+            status, _ = await output._perform_request_sync("/call/say", "POST", {"dialogId": DIALOG_ID, "text": "Hi"}, DIALOG_ID)
+            await output.session_pool.close()
+            assert status == 503
+            assert len(stub.requests) == 3
+
+    asyncio.run(run())
+
+
+def test_client_errors_are_not_retried():
+    async def run():
+        async with CVGStub() as stub:
+            stub.script("/call/say", (400, {"error": "invalid"}, 0.0))
+            output = create_output(stub, RetryPolicy(backoff_base=0.01), CircuitBreakerRegistry())
+            status, body = await output._perform_request_sync("/call/say", "POST", {"dialogId": DIALOG_ID}, DIALOG_ID)
+            await output.session_pool.close()
+            assert (status, body) == (400, {"error": "invalid"})
+            assert len(stub.requests) == 1
+
+    asyncio.run(run())
+
+
+def test_open_circuit_breaker_fails_fast_without_sending():
+    async def run():
+        async with CVGStub() as stub:
+            stub.script("/call/say", *[(503, {}, 0.0)] * 2)
+            circuit_breakers = CircuitBreakerRegistry(failure_threshold=2, reset_timeout=60.0)
+            output = create_output(stub, RetryPolicy(max_retries=5, backoff_base=0.01), circuit_breakers)
+            status, _ = await output._perform_request_sync("/call/say", "POST", {"dialogId": DIALOG_ID, "text": "Hi"}, DIALOG_ID)
+            assert status == NOT_SENT
+            assert len(stub.requests) == 2
+            assert circuit_breakers.states() == {f"127.0.0.1:{stub.port}": CircuitBreaker.OPEN}
+
+            status, _ = await output._perform_request_sync("/call/say", "POST", {"dialogId": DIALOG_ID, "text": "Hi"}, DIALOG_ID)
+            await output.session_pool.close()
+            assert status == NOT_SENT
+            assert len(stub.requests) == 2
+
+    asyncio.run(run())
+
+
+def test_slow_forward_is_not_bound_by_the_request_timeout():
+    async def run():
+        async with CVGStub() as stub:
+            stub.script("/call/forward", (200, {"status": "Success"}, 0.3))
+            output = create_output(stub, RetryPolicy(timeout=0.1, outbound_call_timeout=5.0), CircuitBreakerRegistry())
+            status, body = await output._perform_request_sync("/call/forward", "POST", {"dialogId": DIALOG_ID}, DIALOG_ID)
+            await output.session_pool.close()
+            assert (status, body) == (200, {"status": "Success"})
+
+    asyncio.run(run())
+
+
+def test_forward_timeout_is_not_retried_and_does_not_open_the_circuit_breaker():
+    async def run():
+        async with CVGStub() as stub:
+            stub.script("/call/forward", *[(200, {"status": "Success"}, 0.5)] * 2)
+            circuit_breakers = CircuitBreakerRegistry(failure_threshold=1)
+            output = create_output(stub, RetryPolicy(backoff_base=0.01, outbound_call_timeout=0.1), circuit_breakers)
+            for _ in range(2):
+                status, _ = await output._perform_request_sync("/call/forward", "POST", {"dialogId": DIALOG_ID}, DIALOG_ID)
+                assert status == NO_RESPONSE
+            status, _ = await output._perform_request_sync("/call/say", "POST", {"dialogId": DIALOG_ID, "text": "Hi"}, DIALOG_ID)
+            await output.session_pool.close()
+            assert status == 204
+            assert stub.paths() == ["/call/forward", "/call/forward", "/call/say"]
+            assert set(circuit_breakers.states().values()) == {CircuitBreaker.CLOSED}
+
+    asyncio.run(run())
+
+
+def test_commands_alongside_speech_only_overtake_speech():
+    async def run():
+        queue = DialogCommandQueue()
+        events = []
+
+        async def command(name, delay):
+            events.append(f"start {name}")
+            await asyncio.sleep(delay)
+            events.append(f"end {name}")
+            return name
+
+        say = queue.submit(DIALOG_ID, command("say", 0.1), speech=True)
+        data = queue.submit(DIALOG_ID, command("data", 0.0), alongside_speech=True)
+        delete = queue.submit(DIALOG_ID, command("delete", 0.0))
+        assert await data == "data"
+        assert events == ["start say", "start data", "end data"]
+        await asyncio.gather(say, delete)
+        assert events[3:] == ["end say", "start delete", "end delete"]
+
+        blocking = queue.submit(DIALOG_ID, command("forward", 0.05))
+        late_data = queue.submit(DIALOG_ID, command("late data", 0.0), alongside_speech=True)
+        await asyncio.gather(blocking, late_data)
+        assert events[6:] == ["start forward", "end forward", "start late data", "end late data"]
+
+    asyncio.run(run())
+
+
+def test_durable_commands_keep_their_order_relative_to_other_commands():
+    async def run():
+        async with CVGStub() as stub:
+            stub.script("/call/say", (204, None, 0.1))
+            outbox = create_outbox("memory", None, 60.0, OUTBOX_RETRYABLE_STATUS_CODES, 100, 0.05, 0.01, 0.02)
+            output = create_output(stub, RetryPolicy(backoff_base=0.01), CircuitBreakerRegistry(), outbox)
+            recipient_id = create_recipient_id("reseller", "project", DIALOG_ID)
+            await output.send_custom_json(recipient_id, {"cvg_dialog_delete": {}, "cvg_call_drop": {}})
+            await output.send_text_message(recipient_id, "Hi", None)
+            await output.send_custom_json(recipient_id, {"cvg_dialog_data": {"type": "Custom"}, "cvg_call_drop": {}})
+            await output.task_container.drain(5.0)
+            await outbox.close()
+            await output.session_pool.close()
+            # Only dialog_data is sent alongside the slow say, the drop still waits for it
+            assert stub.paths() == ["/dialog/reseller/" + DIALOG_ID, "/call/drop", "/call/say", "/dialog/reseller/" + DIALOG_ID + "/data", "/call/drop"]
+
+    asyncio.run(run())
+
+
+def test_commands_after_a_bridge_do_not_wait_for_the_callee():
+    async def run():
+        async with CVGStub() as stub:
+            stub.script("/call/say", (204, None, 0.1))
+            stub.script("/call/bridge", (200, {"status": "Success"}, 1.0))
+            output = create_output(stub, RetryPolicy(backoff_base=0.01), CircuitBreakerRegistry())
+            recipient_id = create_recipient_id("reseller", "project", DIALOG_ID)
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            await output.send_text_message(recipient_id, "Connecting you", None)
+            await output.send_custom_json(recipient_id, {"cvg_call_bridge": {"headNumber": "+4912345"}, "cvg_dialog_data": {"type": "Custom"}})
+            await output.send_text_message(recipient_id, "Please hold", None)
+            elapsed = loop.time() - start
+            await output.task_container.drain(5.0)
+            await output.session_pool.close()
+            assert elapsed < 0.5
+            # The bridge still waits for the say ahead of it, the commands after it are sent while it rings
+            assert stub.paths()[0] == "/call/say"
+            assert sorted(stub.paths()[1:]) == ["/call/bridge", "/call/say", "/dialog/reseller/" + DIALOG_ID + "/data"]
+
+    asyncio.run(run())
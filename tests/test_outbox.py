@@ -0,0 +1,118 @@
+import asyncio
+
+from rasa_vier_cvg import metrics
+from rasa_vier_cvg.cvg import NO_RESPONSE, NOT_SENT, OUTBOX_RETRYABLE_STATUS_CODES
+from rasa_vier_cvg.outbox import InMemoryOutboxStore, Outbox, OutboxCommand, SqliteOutboxStore
+
+
+def create_command(dialog_id, text, ttl=60.0):
+    return OutboxCommand.create(dialog_id, "http://localhost", "auth-token", "POST", "/dialog/data", {"text": text}, ttl)
+
+
+def create_outbox(store=None, ttl=60.0):
+    return Outbox(store or InMemoryOutboxStore(), ttl, OUTBOX_RETRYABLE_STATUS_CODES, 10, 0.01, 0.01, 0.02)
+
+
+class RecordingDelivery:
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.delivered = []
+
+    async def __call__(self, command):
+        self.delivered.append((command.dialog_id, command.data["text"]))
+        await asyncio.sleep(0.01)
+        return (self.statuses.pop(0) if self.statuses else 204), {}
+
+
+def send(outbox, command, deliver):
+    return outbox.send(command, outbox.add(command), deliver)
+
+
+def test_commands_are_sent_again_until_they_reach_cvg():
+    async def run():
+        outbox = create_outbox()
+        deliver = RecordingDelivery(NOT_SENT, 503)
+        status, _ = await send(outbox, create_command("a", "1"), deliver)
+        assert outbox.backlog == 0
+        await outbox.close()
+        assert status == 204
+        assert deliver.delivered == [("a", "1")] * 3
+
+    asyncio.run(run())
+
+
+def test_commands_without_a_response_are_not_sent_again():
+    async def run():
+        outbox = create_outbox()
+        deliver = RecordingDelivery(NO_RESPONSE)
+        status, _ = await send(outbox, create_command("a", "1"), deliver)
+        await outbox.close()
+        assert status == NO_RESPONSE
+        assert deliver.delivered == [("a", "1")]
+
+    asyncio.run(run())
+
+
+def test_commands_are_given_up_when_they_expire():
+    async def run():
+        outbox = create_outbox(ttl=0.1)
+        deliver = RecordingDelivery(*[NOT_SENT] * 100)
+        expired = metrics.OUTBOX_EXPIRED.get()
+        status, _ = await send(outbox, create_command("a", "1", ttl=0.1), deliver)
+        await outbox.close()
+        assert status == NOT_SENT
+        assert 1 < len(deliver.delivered) < 100
+        assert metrics.OUTBOX_EXPIRED.get() == expired + 1
+
+    asyncio.run(run())
+
+
+def test_commands_are_only_retried_once_they_have_been_stored(tmp_path):
+    path = str(tmp_path / "outbox.db")
+
+    async def run():
+        outbox = create_outbox(SqliteOutboxStore(path))
+        stored = []
+
+        async def deliver(command):
+            store = SqliteOutboxStore(path)
+            stored.append(len(await store.load()))
+            await store.close()
+            return NOT_SENT if len(stored) == 1 else 204, {}
+
+        await send(outbox, create_command("a", "1"), deliver)
+        await outbox.close()
+        # The first attempt does not wait for the batch, the retry does
+        assert stored[1] == 1
+
+    asyncio.run(run())
+
+
+def test_undelivered_commands_are_delivered_after_a_restart(tmp_path):
+    path = str(tmp_path / "outbox.db")
+
+    async def crash():
+        # The commands are only stored, like in a process that stopped before sending them
+        outbox = create_outbox(SqliteOutboxStore(path))
+        for text in ["1", "2", "3"]:
+            outbox.add(create_command("a", text))
+        await outbox.close()
+
+    async def restart():
+        outbox = create_outbox(SqliteOutboxStore(path))
+        deliver = RecordingDelivery()
+        await outbox.start(deliver)
+        while outbox.backlog:
+            await asyncio.sleep(0.01)
+        await outbox.close()
+        return deliver.delivered
+
+    async def load():
+        store = SqliteOutboxStore(path)
+        commands = await store.load()
+        await store.close()
+        return commands
+
+    asyncio.run(crash())
+    assert asyncio.run(restart()) == [("a", "1"), ("a", "2"), ("a", "3")]
+    assert asyncio.run(load()) == []
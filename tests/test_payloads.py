@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from rasa_vier_cvg.cvg import CVGInput
+from tests.webhook_server import serve_webhook
+
+TOKEN = "token"
+
+
+def create_body(**fields):
+    body = {
+        "dialogId": "09e59647-5c77-4c02-a1c5-7fb2b47060f1",
+        "callback": "http://127.0.0.1:1",
+        "authToken": "auth-token",
+        "projectContext": {"resellerToken": "reseller", "projectToken": "project"},
+        "timestamp": 1535546718115,
+    }
+    body.update(fields)
+    return {key: value for key, value in body.items() if value is not None}
+
+
+@pytest.mark.parametrize("route, body, error", [
+    ("message", create_body(text="hello", authToken=None), "authToken is required"),
+    ("message", create_body(), "text is required"),
+    ("message", create_body(text=42), "text must be a string"),
+    ("answer", create_body(), "type is required"),
+    ("answer", create_body(type={"id": "1"}), "name is required in type"),
+    ("inactivity", create_body(projectContext=None), "projectContext is required"),
+    ("inactivity", create_body(projectContext={"projectToken": "project"}), "resellerToken is required in projectContext"),
+    ("terminated", create_body(projectContext={"resellerToken": "reseller"}), "projectToken is required in projectContext"),
+    ("session", create_body(dialogId=None), "dialogId is required"),
+    ("recording", [], "body must be a JSON object"),
+])
+def test_requests_missing_a_required_field_are_rejected(route, body, error):
+    async def scenario():
+        received = []
+
+        async def on_new_message(message):
+            received.append(message)
+
+        channel = CVGInput(TOKEN, "/cvg_session", None, True, False, "off")
+        async with serve_webhook(channel, TOKEN, on_new_message) as client:
+            status, _, text = await client.post(route, body)
+        assert (status, text) == (400, error)
+        assert received == []
+
+    asyncio.run(scenario())
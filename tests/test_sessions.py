@@ -0,0 +1,78 @@
+import asyncio
+
+from rasa_vier_cvg.cvg import CVGInput, DialogSession, DialogSessionRegistry
+from rasa_vier_cvg.payloads import MessageRequest
+from tests.cvg_stub import CVGStub
+from tests.test_deduplication import FakeClock
+
+
+def create_session(dialog_id):
+    return DialogSession(dialog_id, dialog_id, "http://localhost", "auth-token", None)
+
+
+def test_the_least_recently_used_session_is_evicted_beyond_max_sessions():
+    registry = DialogSessionRegistry(max_sessions=2, clock=FakeClock())
+    first, second, third = create_session("first"), create_session("second"), create_session("third")
+    registry.add(first)
+    registry.add(second)
+    assert registry.get("first") is first
+
+    registry.add(third)
+    assert len(registry) == 2
+    assert registry.get("second") is None
+    assert registry.get("first") is first
+    assert registry.get("third") is third
+
+
+def test_sessions_idle_for_longer_than_the_ttl_are_evicted():
+    clock = FakeClock()
+    registry = DialogSessionRegistry(ttl=60.0, clock=clock)
+    idle, active = create_session("idle"), create_session("active")
+    registry.add(idle)
+    registry.add(active)
+
+    clock.now = 40.0
+    assert registry.get("active") is active
+    clock.now = 70.0
+    assert registry.get("idle") is None
+    assert registry.get("active") is active
+    assert len(registry) == 1
+
+
+def create_message(stub, dialog_id, text):
+    return MessageRequest({
+        "dialogId": dialog_id,
+        "callback": stub.url,
+        "authToken": "auth-token",
+        "projectContext": {"resellerToken": "reseller", "projectToken": "project"},
+        "text": text,
+    })
+
+
+def test_a_session_created_again_after_its_eviction_still_supersedes_the_queued_speech():
+    async def run():
+        async with CVGStub() as stub:
+            stub.script("/call/say", (204, None, 0.2))
+            channel = CVGInput("token", "/cvg_session", None, True, False, "off", dialog_sessions=DialogSessionRegistry(max_sessions=1))
+            replies = {"hi": ["one", "two", "three"], "other": [], "stop": ["four"]}
+
+            async def on_new_message(message):
+                for reply in replies[message.text]:
+                    await message.output_channel.send_text_message(message.sender_id, reply, None)
+
+            async def process(payload):
+                session = channel._get_session(payload, on_new_message)
+                await channel._process_message(payload, session, on_new_message, payload.text)
+                return session
+
+            evicted = await process(create_message(stub, "dialog", "hi"))
+            await process(create_message(stub, "other dialog", "other"))
+            await asyncio.sleep(0.05)
+            # "two" and "three" are still queued behind the slow "one" when the dialog gets a new session
+            assert await process(create_message(stub, "dialog", "stop")) is not evicted
+            await asyncio.sleep(0.3)
+            await channel.task_container.drain(5.0)
+            await channel.session_pool.close()
+            assert [body["text"] for _, path, body in stub.requests if path == "/call/say"] == ["one", "four"]
+
+    asyncio.run(run())
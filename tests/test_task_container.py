@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from rasa_vier_cvg.cvg import CVGInput, TaskContainer, TaskContainerFull
+from tests.webhook_server import serve_webhook
+
+TOKEN = "token"
+
+
+def test_tasks_beyond_the_cap_wait_for_a_free_slot_and_are_rejected_beyond_the_queue():
+    async def run():
+        container = TaskContainer(max_tasks=2, max_queued=1)
+        release = asyncio.Event()
+        started = []
+
+        async def work(name):
+            started.append(name)
+            await release.wait()
+
+        assert container.run(work("first")) is not None
+        assert container.run(work("second")) is not None
+        assert container.run(work("third")) is None
+        assert container.queue_depth == 1
+        with pytest.raises(TaskContainerFull):
+            container.run(work("fourth"))
+        # Unbounded tasks are started regardless of the cap
+        assert container.run(work("unbounded"), bounded=False) is not None
+        await asyncio.sleep(0)
+        assert started == ["first", "second", "unbounded"]
+
+        release.set()
+        await container.drain(1.0)
+        assert started == ["first", "second", "unbounded", "third"]
+        assert not container.tasks and container.queue_depth == 0
+
+    asyncio.run(run())
+
+
+def test_drain_cancels_the_tasks_still_running_after_the_deadline():
+    async def run():
+        container = TaskContainer(max_tasks=1)
+        finished = []
+
+        async def work(seconds):
+            await asyncio.sleep(seconds)
+            finished.append(seconds)
+
+        running = container.run(work(0.01))
+        await asyncio.sleep(0.02)
+        stuck = container.run(work(10.0))
+        container.run(work(0.0))
+        await container.drain(0.05)
+        assert running.done() and finished == [0.01]
+        await asyncio.sleep(0)
+        assert stuck.cancelled()
+        assert container.queue_depth == 0
+
+    asyncio.run(run())
+
+
+def create_body(dialog_id, text):
+    return {
+        "dialogId": dialog_id,
+        "callback": "http://127.0.0.1:1",
+        "authToken": "auth-token",
+        "projectContext": {"resellerToken": "reseller", "projectToken": "project"},
+        "timestamp": 1535546718115,
+        "text": text,
+    }
+
+
+def test_messages_are_rejected_with_retry_after_while_the_container_is_full():
+    async def scenario():
+        release = asyncio.Event()
+        received = []
+
+        async def on_new_message(message):
+            received.append(message.text)
+            await release.wait()
+
+        channel = CVGInput(TOKEN, "/cvg_session", None, False, False, "off", task_container=TaskContainer(max_tasks=1, max_queued=0))
+        async with serve_webhook(channel, TOKEN, on_new_message) as client:
+            assert (await client.post("message", create_body("first", "hello")))[0] == 204
+            status, headers, _ = await client.post("message", create_body("second", "hello"))
+            assert status == 503
+            assert headers["Retry-After"] == "1"
+
+            release.set()
+            await asyncio.sleep(0.05)
+            # The rejected request is delivered again by CVG and must not be taken for a duplicate
+            assert (await client.post("message", create_body("second", "hello")))[0] == 204
+            await asyncio.sleep(0.05)
+        assert received == ["hello", "hello"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,100 @@
+import asyncio
+
+from rasa_vier_cvg.cvg import CURRENT_TURN, CVGInput
+from rasa_vier_cvg.payloads import InactivityRequest, MessageRequest
+from tests.cvg_stub import CVGStub
+
+DIALOG_ID = "09e59647-5c77-4c02-a1c5-7fb2b47060f1"
+
+
+def create_body(stub: CVGStub, **fields):
+    body = {
+        "dialogId": DIALOG_ID,
+        "callback": stub.url,
+        "authToken": "auth-token",
+        "projectContext": {"resellerToken": "reseller", "projectToken": "project"},
+    }
+    body.update(fields)
+    return body
+
+
+def said(stub: CVGStub):
+    return [body["text"] for _, path, body in stub.requests if path == "/call/say"]
+
+
+async def process(channel: CVGInput, payload, on_new_message, text):
+    session = channel._get_session(payload, on_new_message)
+    await channel._process_message(payload, session, on_new_message, text)
+
+
+async def close(channel: CVGInput):
+    await channel.task_container.drain(5.0)
+    await channel.session_pool.close()
+
+
+def test_speech_in_response_to_a_bridge_result_survives_later_turns():
+    async def run():
+        async with CVGStub() as stub:
+            stub.script("/call/bridge", (200, {"status": "Success"}, 0.2))
+            channel = CVGInput("token", "/cvg_session", None, True, False, "off")
+
+            async def on_new_message(message):
+                output = message.output_channel
+                if message.text == "connect me":
+                    await output.send_custom_json(message.sender_id, {"cvg_call_bridge": {"headNumber": "+4912345"}})
+                elif message.text == "/cvg_outbound_success":
+                    await output.send_text_message(message.sender_id, "You are connected now", None)
+
+            await process(channel, MessageRequest(create_body(stub, text="connect me")), on_new_message, "connect me")
+            # The caller says something else while the callee is still ringing
+            await process(channel, MessageRequest(create_body(stub, text="hello?")), on_new_message, "hello?")
+            await asyncio.sleep(0.3)
+            await close(channel)
+            assert said(stub) == ["You are connected now"]
+            assert CURRENT_TURN.get() is None
+
+    asyncio.run(run())
+
+
+def test_only_new_messages_cancel_queued_speech():
+    async def run():
+        async with CVGStub() as stub:
+            stub.script("/call/say", (204, None, 0.2))
+            channel = CVGInput("token", "/cvg_session", None, True, False, "off")
+            replies = {"hi": ["one", "two"], "/cvg_inactivity": ["three"], "stop": ["four"]}
+
+            async def on_new_message(message):
+                for reply in replies[message.text]:
+                    await message.output_channel.send_text_message(message.sender_id, reply, None)
+
+            await process(channel, MessageRequest(create_body(stub, text="hi")), on_new_message, "hi")
+            await process(channel, InactivityRequest(create_body(stub)), on_new_message, "/cvg_inactivity")
+            await asyncio.sleep(0.05)
+            assert said(stub) == ["one"]
+            # "two" and "three" are still queued behind the slow "one"
+            await process(channel, MessageRequest(create_body(stub, text="stop")), on_new_message, "stop")
+            await asyncio.sleep(0.3)
+            await close(channel)
+            assert said(stub) == ["one", "four"]
+
+    asyncio.run(run())
+
+
+def test_speech_of_an_inactivity_event_is_sent():
+    async def run():
+        async with CVGStub() as stub:
+            stub.script("/call/say", (204, None, 0.1))
+            channel = CVGInput("token", "/cvg_session", None, True, False, "off")
+            replies = {"hi": ["one", "two"], "/cvg_inactivity": ["three"]}
+
+            async def on_new_message(message):
+                for reply in replies[message.text]:
+                    await message.output_channel.send_text_message(message.sender_id, reply, None)
+
+            await process(channel, MessageRequest(create_body(stub, text="hi")), on_new_message, "hi")
+            await process(channel, InactivityRequest(create_body(stub)), on_new_message, "/cvg_inactivity")
+            await asyncio.sleep(0.2)
+            await close(channel)
+            assert said(stub) == ["one", "two", "three"]
+
+    asyncio.run(run())
@@ -0,0 +1,48 @@
+import json
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Text, Tuple
+
+from aiohttp import ClientSession
+from sanic import Sanic
+
+from rasa.core.channels.channel import UserMessage
+
+from rasa_vier_cvg.cvg import CVGInput
+from tests.cvg_stub import free_port
+
+WEBHOOK_PREFIX = "/webhooks/vier-cvg"
+
+
+class WebhookClient:
+    """Sends requests to the webhook of a channel served by serve_webhook"""
+
+    def __init__(self, session: ClientSession, base_url: Text, token: Text) -> None:
+        self.session = session
+        self.base_url = base_url
+        self.token = token
+
+    async def post(self, route: Text, body: Any) -> Tuple[int, Dict[Text, Text], Text]:
+        headers = {"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"}
+        async with self.session.post(f"{self.base_url}/{route}", data=json.dumps(body), headers=headers) as res:
+            return res.status, dict(res.headers), await res.text()
+
+
+@asynccontextmanager
+async def serve_webhook(channel: CVGInput, token: Text, on_new_message: Callable[[UserMessage], Awaitable[Any]]) -> AsyncIterator[WebhookClient]:
+    """Serves the webhook of the channel on a free local port, stopping it like Rasa does on shutdown"""
+    app = Sanic(f"cvg_test_{uuid.uuid4().hex}")
+    # TouchUp fails for every app started after the first one in the same process
+    app.config.TOUCHUP = False
+    app.blueprint(channel.blueprint(on_new_message), url_prefix=WEBHOOK_PREFIX)
+    port = free_port()
+    server = await app.create_server(host="127.0.0.1", port=port, access_log=False, return_asyncio_server=True)
+    await server.startup()
+    await server.start_serving()
+    try:
+        async with ClientSession() as session:
+            yield WebhookClient(session, f"http://127.0.0.1:{port}{WEBHOOK_PREFIX}", token)
+    finally:
+        await server.before_stop()
+        await server.close()
+        await server.after_stop()